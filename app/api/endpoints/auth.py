@@ -6,10 +6,13 @@ from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel, EmailStr
 
 # Import services
-from app.services.user_service import create_user, get_user_by_email, verify_password, get_user_by_id
+from app.services.user_service import (
+    create_user, get_user_by_email, get_user_by_id,
+    verify_and_update_password, update_password_hash, PasswordHasherBusy
+)
 # Import centralized config and dependencies
 from app.core.config import settings
-from app.api.endpoints.dependencies import get_current_user_id, oauth2_scheme
+from app.api.endpoints.dependencies import get_current_user_id, oauth2_scheme, login_limiter
 
 router = APIRouter()
 
@@ -58,6 +61,8 @@ async def register(user_data: UserCreate, request: Request):
     except ValueError as e:
         # Handle "User already exists" nicely
         raise HTTPException(status_code=400, detail=str(e))
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         print(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail="Registration failed")
@@ -68,16 +73,32 @@ async def login(
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     pool = request.app.state.pool
-    
-    user = await get_user_by_email(pool, form_data.username)
-    
+    client_ip = request.client.host if request.client else "unknown"
+
+    async with login_limiter.slot(client_ip):
+        user = await get_user_by_email(pool, form_data.username)
+
+        valid, new_hash = False, None
+        if user:
+            try:
+                valid, new_hash = await verify_and_update_password(form_data.password, user["password_hash"])
+            except PasswordHasherBusy as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
     # Combined check for security (prevents timing attacks/user enumeration)
-    if not user or not await verify_password(form_data.password, user["password_hash"]):
+    if not user or not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Cost parameters changed since this hash was made -> store the upgraded hash
+    if new_hash:
+        try:
+            await update_password_hash(pool, user["id"], new_hash)
+        except Exception as e:
+            print(f"⚠️ Password rehash failed for {user['id']}: {e}")
     
     if not user.get("is_active", True):
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -1,15 +1,29 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
-from langchain_core.messages import HumanMessage
+from fastapi import APIRouter, Request, HTTPException, Depends, Query, Response
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.callbacks import UsageMetadataCallbackHandler
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import json
+import time
 import traceback
+from contextlib import aclosing
 
-from app.api.endpoints.dependencies import get_current_user_id
-from app.services.history import upsert_thread, get_user_threads
+from app.api.endpoints.dependencies import get_current_user_id, get_rag_graph
+from app.core.config import settings
+from app.core.metrics import RETRIEVAL_LOOPS, CHAT_SECONDS
+from app.core.pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.history import (
+    upsert_thread, get_user_threads, get_thread, get_thread_messages,
+    append_thread_messages, index_thread_messages
+)
 from app.schemas.chat import ChatRequest
-from app.services.graph.graph import build_rag_graph 
 from app.services.graph.tools import UserContext
+from app.services.answer_cache import answer_cache
+from app.services.admission import chat_admission, release_when_done
+from app.services.checkpoints import get_thread_storage_stats
+from app.services.streaming import (
+    StreamEncoder, negotiate_format, INTERNAL_TAGS, STATS_HEADER, cancel_on_disconnect, stream_stats
+)
 
 router = APIRouter()
 
@@ -17,9 +31,26 @@ router = APIRouter()
 async def chat_endpoint(
     request: Request, 
     payload: ChatRequest,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    app_graph = Depends(get_rag_graph),
+    stream_format: str | None = Query(None, description="lines | sse | length (defaults to the Accept header)")
 ):
+    # Admission first: a rejected request costs no DB or LLM work. The slot is held
+    # until the stream ends (BackgroundTask covers a response that never starts streaming).
+    ticket = await chat_admission.acquire(user_id)
+    try:
+        return await _chat_response(request, payload, user_id, app_graph, stream_format, ticket)
+    except BaseException:
+        # Failed or cancelled before a response took over the slot
+        await ticket.release()
+        raise
+
+
+async def _chat_response(request: Request, payload: ChatRequest, user_id: str, app_graph,
+                         stream_format: str | None, ticket) -> StreamingResponse:
     pool = request.app.state.pool
+    encoder = StreamEncoder(negotiate_format(stream_format, request.headers.get("accept")))
+    want_stats = request.headers.get(STATS_HEADER) == "1"
 
     # Save thread metadata
     try:
@@ -28,10 +59,7 @@ async def chat_endpoint(
     except Exception as e:
         print(f"Failed to save history: {e}")
 
-    # Setup Graph and Config
-    checkpointer = AsyncPostgresSaver(pool)
-    app_graph = build_rag_graph(checkpointer)
-    
+    # Per-request config (the compiled graph is shared)
     config = {
         "configurable": {"thread_id": payload.thread_id},
         "metadata": {"chat_title": payload.query[:5]}
@@ -39,128 +67,242 @@ async def chat_endpoint(
     context = UserContext(user_id=user_id)
     input_message = HumanMessage(content=payload.query)
 
+    try:
+        await append_thread_messages(pool, payload.thread_id, [input_message])
+    except Exception as e:
+        print(f"Failed to save message: {e}")
+
+    # Semantic answer cache: repeated questions skip the graph entirely. Only for the
+    # first turn of a thread: later answers depend on the conversation so far.
+    cache_probe = None
+    if settings.ANSWER_CACHE_ENABLED:
+        try:
+            state = await app_graph.aget_state(config)
+            if not state.values.get("messages"):
+                cache_probe = await answer_cache.lookup(user_id, payload.query)
+        except Exception as e:
+            print(f"⚠️ Answer cache lookup failed: {e}")
+
+    if cache_probe and cache_probe[0]:
+        cached = cache_probe[0]
+
+        async def cached_stream():
+            yield encoder.event("NODE", "Answer Cache")
+            yield encoder.event("CONTENT", cached.answer)
+            if want_stats:
+                yield encoder.event("STATS", json.dumps({"cached": True, "loops": 0, "nodes": {}, "tokens": {}}))
+            # Record the turn in the thread like a normal answer
+            try:
+                await app_graph.aupdate_state(
+                    config,
+                    {"messages": [input_message, AIMessage(content=cached.answer)]},
+                    as_node="generate_answer"
+                )
+                await append_thread_messages(pool, payload.thread_id, [AIMessage(content=cached.answer)])
+            except Exception as e:
+                print(f"Failed to save cached answer to thread: {e}")
+
+        return StreamingResponse(
+            release_when_done(ticket, cached_stream()),
+            media_type=encoder.media_type,
+            background=BackgroundTask(ticket.release)
+        )
+
     async def event_stream():
+        started = time.perf_counter()
+        answer_parts = []
+        transcript = []  # AI messages shown in the thread (tool-call turns and answers)
+        node_counts = {}
+        # Sees every LLM call, including the internal ones filtered out of the event stream
+        usage = UsageMetadataCallbackHandler()
+        run_config = {**config, "callbacks": [usage]} if want_stats else config
         try:
             in_think_block = False
             
-            async for event in app_graph.astream_events(
+            # Internal LLM calls (grading, rewrites, summaries) are dropped by
+            # astream_events itself; retriever/prompt/parser events are never produced.
+            # aclosing: a cancelled stream (client gone) shuts the graph run down right away
+            events = app_graph.astream_events(
                 {"messages": [input_message]}, 
-                config=config, 
+                config=run_config, 
                 version="v2",
-                context=context
-            ):
-                event_type = event.get("event")
-                metadata = event.get("metadata", {})
-                current_node = metadata.get("langgraph_node", "")
-
-                # --- 1. CAPTURE WORKFLOW STEPS ---
-                if event_type == "on_chain_start":
-                    tags = event.get("tags", [])
-                    is_node = any(t.startswith("graph:step") for t in tags)
-                    if is_node and current_node:
-                        display_name = current_node.replace("_", " ").title()
-                        yield f"NODE:{display_name}\n"
-
-                # --- 2. STREAM LLM CONTENT & REASONING ---
-                elif event_type == "on_chat_model_stream":
-                    
-                    # Filter out internal nodes (grader/rewriter) if you don't want users seeing them
-                    tags = event.get("tags", [])
-                    if "internal_grading" in tags:
-                        continue
-                        
-                    INTERNAL_NODES = ["grade_documents", "rewrite_question"]
-                    if current_node in INTERNAL_NODES:
-                        continue
-
-                    chunk = event["data"].get("chunk")
-                    if chunk:
-                        # --- EXTRACT REASONING ---
-                        # OpenRouter often puts reasoning in 'reasoning' field of extra_body/additional_kwargs
-                        reasoning_chunk = ""
+                context=context,
+                include_types=["chain", "chat_model", "tool"],
+                exclude_tags=INTERNAL_TAGS
+            )
+            async with aclosing(events):
+                async for event in events:
+                    event_type = event.get("event")
+                    metadata = event.get("metadata", {})
+                    current_node = metadata.get("langgraph_node", "")
+
+                    # --- 1. CAPTURE WORKFLOW STEPS ---
+                    if event_type == "on_chain_start":
+                        tags = event.get("tags", [])
+                        is_node = any(t.startswith("graph:step") for t in tags)
+                        if is_node and current_node:
+                            node_counts[current_node] = node_counts.get(current_node, 0) + 1
+                            display_name = current_node.replace("_", " ").title()
+                            yield encoder.event("NODE", display_name)
+
+                    # --- 2. STREAM LLM CONTENT & REASONING ---
+                    elif event_type == "on_chat_model_stream":
+                        chunk = event["data"].get("chunk")
+                        if chunk:
+                            # --- EXTRACT REASONING ---
+                            # OpenRouter often puts reasoning in 'reasoning' field of extra_body/additional_kwargs
+                            reasoning_chunk = ""
                         
-                        # Check location 1: standard additional_kwargs (LangChain standard)
-                        if hasattr(chunk, "additional_kwargs"):
-                            reasoning_chunk = chunk.additional_kwargs.get("reasoning", "")
+                            # Check location 1: standard additional_kwargs (LangChain standard)
+                            if hasattr(chunk, "additional_kwargs"):
+                                reasoning_chunk = chunk.additional_kwargs.get("reasoning", "")
                         
-                        # Check location 2: Sometimes it's directly in the dict if not parsed to object
-                        if not reasoning_chunk and isinstance(chunk, dict):
-                             reasoning_chunk = chunk.get("reasoning", "")
-
-                        # --- HANDLE THINKING STATE ---
-                        if reasoning_chunk:
-                            if not in_think_block:
-                                yield "THINKING_START\n"
-                                in_think_block = True
+                            # Check location 2: Sometimes it's directly in the dict if not parsed to object
+                            if not reasoning_chunk and isinstance(chunk, dict):
+                                 reasoning_chunk = chunk.get("reasoning", "")
+
+                            # --- HANDLE THINKING STATE ---
+                            if reasoning_chunk:
+                                if not in_think_block:
+                                    yield encoder.event("THINKING_START")
+                                    in_think_block = True
                             
-                            # Clean up newlines if necessary, or just stream raw
-                            yield f"THINKING:{reasoning_chunk}\n"
+                                frames = encoder.delta("THINKING", reasoning_chunk)
+                                if frames:
+                                    yield frames
 
-                        # --- EXTRACT CONTENT ---
-                        content_chunk = chunk.content
+                            # --- EXTRACT CONTENT ---
+                            content_chunk = chunk.content
                         
-                        # If we get content but we are currently in a think block, close it
-                        if content_chunk:
-                            if in_think_block:
-                                yield "THINKING_END\n"
-                                in_think_block = False
+                            # If we get content but we are currently in a think block, close it
+                            if content_chunk:
+                                if in_think_block:
+                                    yield encoder.event("THINKING_END")
+                                    in_think_block = False
                             
-                            yield f"CONTENT:{content_chunk}\n"
-
-                # --- 3. HANDLE TOOL CALLS ---
-                elif event_type == "on_chat_model_end":
-                    # Safety cleanup
-                    if in_think_block:
-                        yield "THINKING_END\n"
-                        in_think_block = False
-
-                    output = event["data"].get("output")
-                    if output and hasattr(output, "tool_calls") and output.tool_calls:
-                        for tool_call in output.tool_calls:
-                            tool_data = {
-                                "name": tool_call.get("name"),
-                                "args": tool_call.get("args", {}),
-                                "id": tool_call.get("id")
-                            }
-                            yield f"TOOL_CALL:{json.dumps(tool_data)}\n"
+                                if current_node == "generate_answer":
+                                    answer_parts.append(content_chunk)
+                                frames = encoder.delta("CONTENT", content_chunk)
+                                if frames:
+                                    yield frames
+
+                    # --- 3. HANDLE TOOL CALLS ---
+                    elif event_type == "on_chat_model_end":
+                        # Safety cleanup
+                        if in_think_block:
+                            yield encoder.event("THINKING_END")
+                            in_think_block = False
+
+                        output = event["data"].get("output")
+                        if output and current_node in ("generate_query_or_respond", "generate_answer"):
+                            transcript.append(output)
+                        if output and hasattr(output, "tool_calls") and output.tool_calls:
+                            for tool_call in output.tool_calls:
+                                tool_data = {
+                                    "name": tool_call.get("name"),
+                                    "args": tool_call.get("args", {}),
+                                    "id": tool_call.get("id")
+                                }
+                                yield encoder.event("TOOL_CALL", json.dumps(tool_data))
+                        else:
+                            # End of an answer: send what is still buffered
+                            frames = encoder.flush()
+                            if frames:
+                                yield frames
                 
-                # --- 4. TOOL OUTPUTS ---
-                elif event_type == "on_tool_end":
-                    tool_name = event.get("name", "Tool")
-                    raw_output = event["data"].get("output", "")
+                    # --- 4. TOOL OUTPUTS ---
+                    elif event_type == "on_tool_end":
+                        tool_name = event.get("name", "Tool")
+                        raw_output = event["data"].get("output", "")
                     
-                    if hasattr(raw_output, "content"):
-                        tool_output = raw_output.content
-                    else:
-                        tool_output = str(raw_output)
+                        if hasattr(raw_output, "content"):
+                            tool_output = raw_output.content
+                        else:
+                            tool_output = str(raw_output)
+
+                        display_output = tool_output[:200] + "..." if len(tool_output) > 200 else tool_output
+
+                        tool_data = {
+                            "name": tool_name,
+                            "output": display_output
+                        }
+                        yield encoder.event("TOOL_END", json.dumps(tool_data))
+
+            frames = encoder.flush()
+            if frames:
+                yield frames
 
-                    display_output = tool_output[:200] + "..." if len(tool_output) > 200 else tool_output
+            # every retrieval round ends in a grading step
+            loops = node_counts.get("grade_documents", 0) + node_counts.get("fanout_retrieve", 0)
+            RETRIEVAL_LOOPS.observe(loops)
+            CHAT_SECONDS.labels(outcome="completed").observe(time.perf_counter() - started)
 
-                    tool_data = {
-                        "name": tool_name,
-                        "output": display_output
-                    }
-                    yield f"TOOL_END:{json.dumps(tool_data)}\n"
+            if want_stats:
+                tokens = {"input": 0, "output": 0, "total": 0}
+                for model_usage in usage.usage_metadata.values():
+                    tokens["input"] += model_usage.get("input_tokens", 0)
+                    tokens["output"] += model_usage.get("output_tokens", 0)
+                    tokens["total"] += model_usage.get("total_tokens", 0)
+                yield encoder.event("STATS", json.dumps({
+                    "cached": False,
+                    "loops": loops,
+                    "nodes": node_counts,
+                    "tokens": tokens,
+                    "seconds": round(time.perf_counter() - started, 4),
+                }))
+
+            try:
+                await append_thread_messages(pool, payload.thread_id, transcript)
+            except Exception as e:
+                print(f"Failed to save messages: {e}")
+
+            # Only grounded answers (generate_answer) are cached
+            if cache_probe and answer_parts:
+                _, embedding, version = cache_probe
+                answer_cache.store(
+                    user_id, payload.query, embedding, version,
+                    "".join(answer_parts), time.perf_counter() - started
+                )
 
         except Exception as e:
+            CHAT_SECONDS.labels(outcome="error").observe(time.perf_counter() - started)
             print(f"Stream Error: {e}")
             traceback.print_exc()
-            yield f"ERROR:{str(e)}\n"
+            yield encoder.event("ERROR", str(e))
 
-    return StreamingResponse(event_stream(), media_type="text/plain")
+    return StreamingResponse(
+        release_when_done(ticket, cancel_on_disconnect(request, event_stream(), label=payload.thread_id, encoder=encoder)),
+        media_type=encoder.media_type,
+        background=BackgroundTask(ticket.release)
+    )
 
     
 
 @router.get("/history")
 async def get_history(
     request: Request,
-    user_id: str = Depends(get_current_user_id)
+    response: Response,
+    user_id: str = Depends(get_current_user_id),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
 ):
+    """
+    One page of the user's threads. The cursor for the next page is sent
+    in the X-Next-Cursor header so the body stays a plain list.
+    """
     pool = request.app.state.pool
+
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        # Pass the pool to the service
-        threads = await get_user_threads(pool, user_id) 
+        # Pass the pool to the service (one extra row tells us if there is a next page)
+        threads = await get_user_threads(pool, user_id, limit + 1, after) 
+        if len(threads) > limit:
+            threads = threads[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(threads[-1]["updated_at"], threads[-1]["thread_id"])
         
         # Clean up data for frontend
         results = []
@@ -173,47 +315,75 @@ async def get_history(
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
 
-# Add these imports
-from langchain_core.messages import HumanMessage, AIMessage
+
+@router.get("/cache/stats")
+async def get_answer_cache_stats(user_id: str = Depends(get_current_user_id)):
+    """
+    Semantic answer cache hit rate and estimated latency saved (this process).
+    """
+    return {"enabled": settings.ANSWER_CACHE_ENABLED, **answer_cache.stats.as_dict()}
+
+
+@router.get("/stream/stats")
+async def get_stream_stats(user_id: str = Depends(get_current_user_id)):
+    """
+    Completed vs. cancelled (client disconnected) chat runs (this process).
+    """
+    return stream_stats.as_dict()
+    
 
 @router.get("/{thread_id}")
-async def get_thread_messages(request: Request, thread_id: str):
+async def get_thread_messages_page(
+    request: Request,
+    thread_id: str,
+    user_id: str = Depends(get_current_user_id),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
+):
     """
-    Fetches the actual message history for a specific thread to display on the frontend.
+    The last `limit` displayable messages of a thread (oldest first), read from
+    thread_messages instead of the checkpoint. Pass `next_cursor` back to load older ones.
     """
     pool = request.app.state.pool
-    checkpointer = AsyncPostgresSaver(pool)
-    app_graph = build_rag_graph(checkpointer)
-    
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # Get the latest state from LangGraph
-    state_snapshot = await app_graph.aget_state(config)
-    
+
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    thread = await get_thread(pool, thread_id)
+    if not thread or str(thread["user_id"]) != str(user_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    if not thread["messages_indexed"]:
+        await index_thread_messages(pool, request.app.state.checkpointer.serde, thread_id)
+
+    rows = await get_thread_messages(pool, thread_id, limit + 1, before)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
     messages = []
-    # If state exists, extract messages
-    if state_snapshot.values and "messages" in state_snapshot.values:
-        for msg in state_snapshot.values["messages"]:
-            # Skip tool messages - they should not be displayed
-            if msg.type == 'tool':
-                continue
-                
-            # Convert LangChain objects to simple JSON for frontend
-            role = "user" if isinstance(msg, HumanMessage) else "bot"
-            
-            # For AI messages, include tool_calls if present
-            msg_dict = {
-                "role": role, 
-                "content": msg.content,
-                "type": msg.type
-            }
-            
-            # Add tool_calls if present
-            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                msg_dict["tool_calls"] = msg.tool_calls
-                
-            messages.append(msg_dict)
-            
-    return {"messages": messages}
+    for row in reversed(rows):
+        msg_dict = {"role": row["role"], "content": row["content"], "type": row["type"]}
+        if row["tool_calls"]:
+            msg_dict["tool_calls"] = row["tool_calls"]
+        messages.append(msg_dict)
+
+    return {"messages": messages, "next_cursor": next_cursor}
+
+
+@router.get("/{thread_id}/storage")
+async def get_thread_storage(request: Request, thread_id: str, user_id: str = Depends(get_current_user_id)):
+    """
+    How much the checkpointer stores for a thread (rows and bytes), for storage planning.
+    """
+    pool = request.app.state.pool
+
+    thread = await get_thread(pool, thread_id)
+    if not thread or str(thread["user_id"]) != str(user_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    return await get_thread_storage_stats(pool, thread_id)
@@ -1,11 +1,43 @@
 # app/api/dependencies.py
-from fastapi import Depends, HTTPException, status
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app.core.config import settings 
+from app.services.dbservice import AsyncFileDBService
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight requests per key (e.g. client IP) in this process.
+    Requests over the limit are rejected with 429 instead of queueing.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._in_flight = defaultdict(int)
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        if self._in_flight[key] >= self.limit:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many concurrent requests",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight[key] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[key] -= 1
+            if self._in_flight[key] <= 0:
+                del self._in_flight[key]
+
+
+login_limiter = ConcurrencyLimiter(settings.LOGIN_MAX_CONCURRENT_PER_IP)
+
 async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
     """
     Validates the token and returns the user_id.
@@ -27,4 +59,18 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
             raise credentials_exception
         return user_id
     except JWTError:
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+
+def get_rag_graph(request: Request):
+    """
+    The compiled RAG graph built once in lifespan (app.state.rag_graph).
+    """
+    return request.app.state.rag_graph
+
+
+def get_file_db(request: Request) -> AsyncFileDBService:
+    """
+    File metadata service bound to the shared async pool (app.state.pool).
+    """
+    return AsyncFileDBService(request.app.state.pool)
\ No newline at end of file
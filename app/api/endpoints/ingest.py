@@ -1,25 +1,47 @@
 from typing import Annotated
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
 from fastapi import Depends
-from app.api.endpoints.dependencies import get_current_user_id
+from app.api.endpoints.dependencies import get_current_user_id, get_file_db
 from app.services.ingestion import get_ingestion_service, IngestionService
 from app.services.tasks import task_ingest_files
 import traceback
 from celery.result import AsyncResult
 from app.core.celery_app import celery_app
 from app.core.config import settings
-from app.services.dbservice import file_db
+from app.core.metrics import INGESTION_STAGE_SECONDS
+from app.core.profiling import profile_task_headers
+from app.core.pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.dbservice import AsyncFileDBService
+from app.services.answer_cache import answer_cache
+from app.services.admission import upload_admission
 from app.services.vector_store import get_vector_store_service, VectorStoreService
 import json
 
 router = APIRouter()
 
 
+async def _get_files_page(file_db: AsyncFileDBService, user_id: str, limit: int, cursor: str | None):
+    """Fetch one keyset page of user_files plus the cursor for the next page (None on the last page)."""
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Fetch one extra row to know whether another page exists
+    files = await file_db.get_user_files(user_id, limit + 1, after)
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_cursor(files[-1]['created_at'], files[-1]['id'])
+    return files, next_cursor
+
+
 @router.post("/upload/")
 async def create_upload_files(
     files: Annotated[list[UploadFile], File(description="Multiple files as UploadFile")],
     user_id: str = Depends(get_current_user_id),
     ingestion_service: IngestionService = Depends(get_ingestion_service),
+    file_db: AsyncFileDBService = Depends(get_file_db),
 ):
 
     for file in files:
@@ -29,30 +51,41 @@ async def create_upload_files(
                 detail=f"File type not supported. Allowed: {ingestion_service.ALLOWED_EXTENSIONS}"
             )
     
+    # Separate, smaller limits than chat: saving + enqueueing holds a slot
+    ticket = await upload_admission.acquire(user_id)
     file_paths = []
-    file_ids = []
-    file_records = []
     
     try:
         for file in files:
-            saved_path = ingestion_service.savefile(file, user_id)
-            file_size = saved_path.stat().st_size
-            
-            # DB Record created as usual
-            fid = file_db.create_file_record(user_id, file.filename, str(saved_path), file_size)
-            
+            with INGESTION_STAGE_SECONDS.labels(stage="save").time():
+                saved_path = ingestion_service.savefile(file, user_id)
             file_paths.append(saved_path)
-            file_ids.append(fid)
-            file_records.append({
+
+        # One INSERT / one transaction for the whole batch
+        file_ids = await file_db.create_file_records(
+            user_id,
+            [(file.filename, str(path), path.stat().st_size) for file, path in zip(files, file_paths)]
+        )
+        file_records = [
+            {
                 "id": fid,
                 "filename": file.filename,
                 "status": "processing",
                 "stage": "queued"
-            })
+            }
+            for fid, file in zip(file_ids, files)
+        ]
         
         str_paths = [str(p) for p in file_paths]
         
-        task = task_ingest_files.delay(str_paths, file_ids, user_id)
+        # Single enqueue for the whole batch
+        # A profiled upload also profiles its ingestion task
+        task = task_ingest_files.apply_async(
+            args=(str_paths, file_ids, user_id), headers=profile_task_headers()
+        )
+
+        # New files -> cached answers for this user may be stale
+        await answer_cache.invalidate(user_id)
         
         return {
             "status": "processing_started",
@@ -67,6 +100,9 @@ async def create_upload_files(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Processing files failed: {str(e)}")
 
+    finally:
+        await ticket.release()
+
 
 @router.get("/task/{task_id}")
 async def get_task_status(
@@ -106,34 +142,41 @@ async def get_task_status(
 
 
 @router.get("/user-files/")
-async def get_user_files(user_id: str = Depends(get_current_user_id)):
+async def get_user_files(
+    user_id: str = Depends(get_current_user_id),
+    file_db: AsyncFileDBService = Depends(get_file_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
+):
     """
-    Standard file listing.
+    Standard file listing (from the database, no filesystem walk).
     """
-    user_dir = settings.BASE_UPLOAD_DIR / user_id
-    if not user_dir.exists():
-        return {"files": []}
-    
-    files = []
-    for file_path in user_dir.iterdir():
-        if file_path.is_file():
-            stat = file_path.stat()
-            files.append({
-                "name": file_path.name,
-                "size": stat.st_size,
-                "uploaded_at": stat.st_mtime,
-                "path": str(file_path)
-            })
-    files.sort(key=lambda x: x["uploaded_at"], reverse=True)
-    return {"files": files}
+    files, next_cursor = await _get_files_page(file_db, user_id, limit, cursor)
+    return {
+        "files": [
+            {
+                "name": file['filename'],
+                "size": file['file_size'],
+                "uploaded_at": file['created_at'].timestamp() if file['created_at'] else None,
+                "path": file['file_path']
+            }
+            for file in files
+        ],
+        "next_cursor": next_cursor
+    }
 
 @router.get("/")
-async def get_user_files_with_metadata(user_id: str = Depends(get_current_user_id)):
+async def get_user_files_with_metadata(
+    user_id: str = Depends(get_current_user_id),
+    file_db: AsyncFileDBService = Depends(get_file_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None
+):
     """
     Get jobstats from db
     """
     try:
-        files = file_db.get_user_files(user_id)
+        files, next_cursor = await _get_files_page(file_db, user_id, limit, cursor)
         response_files = []
         for file in files:
             response_files.append({
@@ -146,18 +189,24 @@ async def get_user_files_with_metadata(user_id: str = Depends(get_current_user_i
                 "job_stats": file['job_stats'] or {}, # <--- REAL DATA HERE
                 "error_message": file['error_message']
             })
-        return {"files": response_files}
+        return {"files": response_files, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error fetching files: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch files: {str(e)}")
 
 @router.get("/{filename}/metadata")
-async def get_file_metadata(filename: str, user_id: str = Depends(get_current_user_id)):
+async def get_file_metadata(
+    filename: str,
+    user_id: str = Depends(get_current_user_id),
+    file_db: AsyncFileDBService = Depends(get_file_db)
+):
     """
     get complted file details
     """
     try:
-        file_record = file_db.get_file_by_name(user_id, filename)
+        file_record = await file_db.get_file_by_name(user_id, filename)
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
         
@@ -182,13 +231,14 @@ async def get_file_chunks(
     file_id: int,
     user_id: str = Depends(get_current_user_id),
     limit: int = 1000,
-    vector_service: VectorStoreService = Depends(get_vector_store_service)
+    vector_service: VectorStoreService = Depends(get_vector_store_service),
+    file_db: AsyncFileDBService = Depends(get_file_db)
 ):
     """
     Fetch chunks from milvus
     """
     try:
-        file_record = file_db.get_file_by_id(file_id)
+        file_record = await file_db.get_file_by_id(file_id)
         if not file_record or str(file_record['user_id']) != user_id:
             raise HTTPException(status_code=404, detail="File not found")
 
@@ -1,10 +1,10 @@
 from celery import Celery
-from app.core.config import Settings
+from app.core.config import settings
 
 celery_app = Celery(
     "rag_worker",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0",
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
     include=["app.services.tasks"]
 )
 
@@ -14,4 +14,10 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    beat_schedule={
+        "compact-checkpoints": {
+            "task": "app.services.tasks.task_compact_checkpoints",
+            "schedule": settings.CHECKPOINT_COMPACTION_INTERVAL_SECONDS,
+        },
+    },
 )
\ No newline at end of file
@@ -6,9 +6,14 @@ class Settings(BaseSettings):
 
     #Ingestion Settings
     BASE_UPLOAD_DIR: Path = Path("data/uploads")
-    DOCLING_DEVICE: str = "cuda"
+    DOCLING_DEVICE: str = "cpu"
     DOCLING_NUM_THREADS: int = 8
 
+    # OCR is only run on pages without a usable text layer
+    OCR_MODE: str = "auto"  # auto | always | never
+    TEXT_LAYER_MIN_CHARS: int = 32
+    TEXT_LAYER_IMAGE_COVERAGE: float = 0.5
+
     #OpenRouter Settings
     OPEN_ROUTER_API: str
     OPEN_ROUTER_VLM_BASE_URL: str = "https://openrouter.ai/api/v1/chat/completions"
@@ -20,6 +25,66 @@ class Settings(BaseSettings):
     OPEN_ROUTER_CHAT_LLM: str = "openai/gpt-4o-mini"
     OPEN_ROUTER_GRADER_LLM: str = "openai/gpt-4o-mini"
 
+    #Shared HTTP clients for LLM / embedding providers (one pool per base URL)
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE: int = 20
+    LLM_HTTP_KEEPALIVE_SECONDS: float = 60.0
+    LLM_HTTP_TIMEOUT_SECONDS: float = 60.0
+    LLM_HTTP_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    LLM_HTTP_CONNECT_RETRIES: int = 2  # failed connects, retried by the transport
+    LLM_HTTP2: bool = False  # needs the 'h2' package
+    LLM_MAX_RETRIES: int = 2  # 429 / 5xx, retried by the OpenAI SDK
+
+    #Fake providers for offline load tests / profiling (app/services/fakes.py), never in production
+    LLM_PROVIDER: str = "openrouter"  # openrouter | fake (chat models and embeddings)
+    VECTOR_STORE_PROVIDER: str = "milvus"  # milvus | fake
+    FAKE_LLM_TTFT_MS: int = 300  # time to first token
+    FAKE_LLM_TOKEN_MS: int = 15  # per streamed token
+    FAKE_LLM_ANSWER_TOKENS: int = 120
+    FAKE_GRADER_RELEVANT_PERCENT: int = 70  # share of chunks / contexts the fake grader accepts
+    FAKE_EMBEDDING_SIZE: int = 1536
+    FAKE_VECTOR_STORE_CHUNKS: int = 200  # synthetic chunks per user
+    FAKE_VECTOR_STORE_LATENCY_MS: int = 30
+
+    #Grading Settings
+    GRADER_MODE: str = "single"  # single (whole context, yes/no) | per_chunk
+    GRADER_BATCH_SIZE: int = 4   # chunks per grader call in per_chunk mode
+    GRADER_CONCURRENCY: int = 5  # parallel grader calls per question
+
+    #Relevance gate in front of the grader: clear accepts / rejects skip the LLM
+    RELEVANCE_GATE: str = "off"  # off | shadow (LLM grades everything, gate only logged: set RELEVANCE_LOG_PATH) | on
+    RELEVANCE_ACCEPT_THRESHOLD: float = 0.7
+    RELEVANCE_REJECT_THRESHOLD: float = 0.2
+    RELEVANCE_SEARCH_WEIGHT: float = 0.3  # hybrid search score (normalised to 0-1)
+    RELEVANCE_OVERLAP_WEIGHT: float = 0.7  # share of question entities found in the chunk
+    RELEVANCE_RERANK: bool = False  # add a FlashRank cross-encoder score (CPU)
+    RELEVANCE_RERANK_WEIGHT: float = 1.0
+    RELEVANCE_RERANK_MODEL: str = "ms-marco-TinyBERT-L-2-v2"
+    RELEVANCE_RERANK_CACHE_DIR: str = "/tmp/flashrank"
+    # Opt-in JSONL decision log for calibrating the thresholds. Rows hold the raw user
+    # question, and the file is appended to without rotation.
+    RELEVANCE_LOG_PATH: str = ""
+    RELEVANCE_LOG_SAMPLE_RATE: float = 1.0  # share of gated questions logged
+
+    #Retrieved chunk texts kept in memory (graph state only holds chunk ids)
+    CHUNK_STORE_MAX_ENTRIES: int = 20_000
+
+    #Query rewriting after a failed grading
+    REWRITE_MODE: str = "sequential"  # sequential (one query per loop) | fanout (all variants at once)
+    FANOUT_TOP_K: int = 20  # fused chunks passed to grading
+    RRF_K: int = 60  # reciprocal rank fusion constant
+
+    #Context packing for generate_answer (instructions + question, then chunks, then recent turns)
+    CONTEXT_TOKEN_BUDGET: int = 6000
+    CONTEXT_TOKENIZER: str = "o200k_base"  # tiktoken encoding of OPEN_ROUTER_CHAT_LLM
+    CONTEXT_SUMMARIZE: bool = True  # fold turns that no longer fit into a rolling summary
+    CONTEXT_SUMMARY_BATCH_TURNS: int = 4  # dropped turns to collect before re-summarizing
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 300
+
+    #Speculative retrieval: search the raw question while the router LLM decides
+    SPECULATIVE_RETRIEVAL: bool = False
+    SPECULATIVE_MATCH_THRESHOLD: float = 0.6  # min word overlap between router query and prefetch
+
     OLLAMA_BASE_URL: str = "http://localhost:11434/v1/chat/completions"
     OLLAMA_VLM_MODEL: str = "llama3.2-vision:latest"
     VLM_TIMEOUT: int = 240
@@ -43,14 +108,86 @@ class Settings(BaseSettings):
     #Chat Model Settings
     OLLAMA_MODEL: str = "qwen3:8b"
 
+    #Chat streaming (token deltas are coalesced into frames)
+    STREAM_DEFAULT_FORMAT: str = "lines"  # lines | sse | length
+    STREAM_FLUSH_INTERVAL_MS: int = 50
+    STREAM_FLUSH_BYTES: int = 256
+    STREAM_DISCONNECT_POLL_SECONDS: float = 0.5  # how often a running /chat checks for a gone client
+    STREAM_QUEUE_SIZE: int = 64  # frames buffered for a slow client before the run waits for it
+
+    #Prometheus metrics (/metrics on the API; Celery workers serve their own)
+    METRICS_ENABLED: bool = True
+    METRICS_WORKER_PORT: int = 0  # first port for worker processes (port + process index), 0 = off
+
+    #Request / task profiling with pyinstrument (nothing is installed unless enabled)
+    PROFILING_ENABLED: bool = False
+    PROFILING_TOKEN: str = ""  # requests sending "X-Profile: <token>" are profiled
+    PROFILING_SAMPLE_RATE: float = 0.0  # share of requests profiled at random
+    PROFILING_TASK_SAMPLE_RATE: float = 0.0  # share of Celery tasks profiled at random
+    PROFILING_INTERVAL_SECONDS: float = 0.001
+    PROFILING_DIR: Path = Path("data/profiles")
+    PROFILING_FORMAT: str = "speedscope"  # speedscope (JSON for speedscope.app) | html
+
+    #Redis (Celery broker, shared caches)
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_BACKOFF_SECONDS: float = 30.0  # after a Redis error, the shared tiers fall back to local state this long
+
+    #Semantic answer cache (per user, invalidated on ingestion)
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_THRESHOLD: float = 0.95  # min cosine similarity between questions
+    ANSWER_CACHE_MAX_ENTRIES_PER_USER: int = 256
+    ANSWER_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+
+    #Exact-match LLM response cache for deterministic internal calls (memory LRU, then Redis)
+    LLM_CACHE_NODES: list[str] = ["grade_documents", "rewrite_question", "fanout_retrieve", "summarize_history"]
+    LLM_CACHE_MAX_ENTRIES: int = 10_000  # in-process tier
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60  # Redis tier
+    LLM_CACHE_REDIS: bool = True
+
+    #Single-flight: identical concurrent query embeddings / searches / temperature-0 LLM calls share one call
+    SINGLEFLIGHT_ENABLED: bool = True
+    SINGLEFLIGHT_REDIS: bool = False  # also across processes (Redis lock + short-lived shared result)
+    SINGLEFLIGHT_LOCK_SECONDS: float = 30  # lock TTL, so a crashed leader doesn't block others
+    SINGLEFLIGHT_WAIT_SECONDS: float = 20  # waiters in other processes give up and call themselves
+    SINGLEFLIGHT_RESULT_TTL_SECONDS: float = 5
+    SINGLEFLIGHT_POLL_SECONDS: float = 0.05
+
     #Postgres
     DB_URI: str
+    DB_POOL_MAX_SIZE: int = 20
+    WORKER_DB_POOL_MAX_SIZE: int = 4
+
+    #Checkpoint retention (Celery beat compacts idle threads)
+    CHECKPOINT_KEEP_LAST: int = 1
+    CHECKPOINT_COMPACTION_INTERVAL_SECONDS: int = 60 * 60
+    CHECKPOINT_COMPACTION_IDLE_SECONDS: int = 10 * 60  # only threads without activity for this long
+    CHECKPOINT_COMPACTION_BATCH: int = 100
+    CHECKPOINT_COMPACTION_MAX_THREADS: int = 10_000  # per run
 
     #JWT
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
 
+    #Password hashing (bcrypt runs in a bounded thread pool)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE: int = 64
+    LOGIN_MAX_CONCURRENT_PER_IP: int = 3
+
+    #Admission control: 429 + Retry-After once a user or the server is at capacity
+    ADMISSION_BACKEND: str = "local"  # local (per instance) | redis (shared by all instances)
+    ADMISSION_LEASE_SECONDS: int = 15 * 60  # a slot that is never released expires after this
+    ADMISSION_POLL_SECONDS: float = 0.25  # queued requests re-check for slots freed elsewhere
+    CHAT_MAX_STREAMS_PER_USER: int = 3
+    CHAT_MAX_STREAMS: int = 40  # concurrent graph runs (each holds pool connections and LLM calls)
+    CHAT_QUEUE_SIZE: int = 40  # requests allowed to wait for a slot
+    CHAT_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    UPLOAD_MAX_PER_USER: int = 2
+    UPLOAD_MAX_IN_FLIGHT: int = 10
+    UPLOAD_QUEUE_SIZE: int = 10
+    UPLOAD_QUEUE_TIMEOUT_SECONDS: float = 5.0
+
     model_config = SettingsConfigDict(
             env_file=ENV_PATH, 
             env_file_encoding='utf-8',
@@ -0,0 +1,61 @@
+from psycopg_pool import AsyncConnectionPool
+
+# Ordered schema migrations: (version, statements).
+# The pool runs in autocommit mode, so indexes can be built CONCURRENTLY
+# without locking writes on large tables.
+MIGRATIONS = [
+    ("0001_listing_indexes", [
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_user_created
+           ON user_files (user_id, created_at DESC, id DESC)""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_threads_user_updated
+           ON threads (user_id, updated_at DESC, thread_id DESC)""",
+    ]),
+    ("0002_thread_messages", [
+        """CREATE TABLE IF NOT EXISTS thread_messages (
+               id BIGSERIAL PRIMARY KEY,
+               thread_id TEXT NOT NULL REFERENCES threads(thread_id) ON DELETE CASCADE,
+               role TEXT NOT NULL,
+               type TEXT NOT NULL,
+               content TEXT NOT NULL DEFAULT '',
+               tool_calls JSONB,
+               created_at TIMESTAMP NOT NULL DEFAULT NOW()
+           )""",
+        """CREATE INDEX IF NOT EXISTS idx_thread_messages_thread_created
+           ON thread_messages (thread_id, created_at DESC, id DESC)""",
+        # Existing threads are backfilled from their checkpoint on first open
+        """ALTER TABLE threads ADD COLUMN IF NOT EXISTS messages_indexed BOOLEAN NOT NULL DEFAULT FALSE""",
+    ]),
+    # Checkpoint compaction walks the idle threads across all users
+    ("0003_threads_updated", [
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_threads_updated
+           ON threads (updated_at, thread_id)""",
+    ]),
+]
+
+# Arbitrary key so only one instance applies migrations at a time
+MIGRATION_LOCK_ID = 814_102
+
+
+async def run_migrations(pool: AsyncConnectionPool):
+    """Apply any migration that has not been recorded in schema_migrations yet."""
+    async with pool.connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        await conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cur = await conn.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in await cur.fetchall()}
+
+            for version, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"🧱 Applying migration {version}...")
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
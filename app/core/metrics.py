@@ -0,0 +1,241 @@
+"""
+Prometheus metrics, served on /metrics (and by Celery workers on METRICS_WORKER_PORT).
+Hot-path instrumentation is plain histogram / counter updates; anything that has
+to be read from another object (pools, caches, HTTP clients) is collected at scrape time.
+"""
+import asyncio
+import functools
+import time
+from typing import Any, Callable
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# LLM calls, graph nodes and whole requests span ms to tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+GRAPH_NODE_SECONDS = Histogram(
+    "docnexus_graph_node_seconds",
+    "Wall time of one RAG graph node run",
+    ["node", "outcome"],  # ok | error | cancelled
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "docnexus_llm_call_seconds", "Wall time of one chat model call", ["model", "node"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "docnexus_llm_tokens", "Tokens reported per chat model call (LLM cache hits included)", ["model", "node", "kind"]
+)
+EMBEDDING_SECONDS = Histogram(
+    "docnexus_embedding_seconds", "Wall time of one embedding call", ["op"], buckets=LATENCY_BUCKETS
+)
+VECTOR_STORE_SECONDS = Histogram(
+    "docnexus_vector_store_seconds",
+    "Wall time of vector store calls (search includes embedding the query)",
+    ["op"],
+    buckets=LATENCY_BUCKETS,
+)
+RETRIEVAL_LOOPS = Histogram(
+    "docnexus_retrieval_loops", "Retrieve + grade rounds per chat request", buckets=(0, 1, 2, 3, 4, 5)
+)
+CHAT_SECONDS = Histogram(
+    "docnexus_chat_seconds", "Wall time of a /chat graph run", ["outcome"], buckets=LATENCY_BUCKETS
+)
+ADMISSION_REJECTED = Counter(
+    "docnexus_admission_rejected", "Requests turned away with 429", ["name", "reason"]
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "docnexus_admission_wait_seconds", "Time admitted requests spent queued", ["name"], buckets=LATENCY_BUCKETS
+)
+INGESTION_STAGE_SECONDS = Histogram(
+    "docnexus_ingestion_stage_seconds", "Wall time of one ingestion stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+
+
+def observe_node(fn: Callable) -> Callable:
+    """
+    Time an async graph node, failed and cancelled runs included (often the slow ones).
+    functools.wraps keeps the signature LangGraph inspects.
+    """
+    histograms = {
+        outcome: GRAPH_NODE_SECONDS.labels(node=fn.__name__, outcome=outcome)
+        for outcome in ("ok", "error", "cancelled")
+    }
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            histograms[outcome].observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """
+    Attached to each chat model (not the whole run), so it only sees LLM events.
+    run_inline keeps LangChain from dispatching it to a thread pool.
+    """
+    run_inline = True
+
+    def __init__(self):
+        self._runs: dict[Any, tuple[float, str]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", "none")
+        self._runs[run_id] = (time.perf_counter(), node)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        started, node = self._runs.pop(run_id, (None, "none"))
+        model = "unknown"
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                model = message.response_metadata.get("model_name", model)
+                usage = message.usage_metadata or {}
+                for kind in ("input_tokens", "output_tokens"):
+                    if usage.get(kind):
+                        LLM_TOKENS.labels(model=model, node=node, kind=kind.removesuffix("_tokens")).inc(usage[kind])
+        if started is not None:
+            LLM_CALL_SECONDS.labels(model=model, node=node).observe(time.perf_counter() - started)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+llm_metrics_handler = LLMMetricsHandler()
+
+
+class TimedEmbeddings(Embeddings):
+    """Wraps an Embeddings implementation and records its latency."""
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+        self._query = EMBEDDING_SECONDS.labels(op="query")
+        self._documents = EMBEDDING_SECONDS.labels(op="documents")
+
+    def embed_query(self, text: str) -> list[float]:
+        with self._query.time():
+            return self.inner.embed_query(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self._documents.time():
+            return self.inner.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        with self._query.time():
+            return await self.inner.aembed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self._documents.time():
+            return await self.inner.aembed_documents(texts)
+
+
+class PoolCollector(Collector):
+    """Postgres pool gauges (psycopg_pool get_stats), read at scrape time."""
+    STATS = {
+        "pool_size": "Connections currently managed by the pool",
+        "pool_available": "Idle connections in the pool",
+        "requests_waiting": "Clients waiting for a connection",
+    }
+    COUNTERS = {
+        "requests_num": "Connections requested from the pool",
+        "requests_wait_ms": "Total time clients waited for a connection (ms)",
+        "requests_errors": "Connection requests that failed or timed out",
+    }
+
+    def __init__(self):
+        self._pools: dict[str, Callable] = {}
+
+    def add(self, name: str, get_pool: Callable):
+        """`get_pool` returns the pool or None (pools can be created lazily)."""
+        self._pools[name] = get_pool
+
+    def collect(self):
+        gauges = {
+            stat: GaugeMetricFamily(f"docnexus_db_{stat}", help_text, labels=["pool"])
+            for stat, help_text in self.STATS.items()
+        }
+        counters = {
+            stat: CounterMetricFamily(f"docnexus_db_{stat}", help_text, labels=["pool"])
+            for stat, help_text in self.COUNTERS.items()
+        }
+        for name, get_pool in self._pools.items():
+            pool = get_pool()
+            if pool is None:
+                continue
+            # get_stats() does not reset the counters (pop_stats() would)
+            stats = pool.get_stats()
+            for stat, family in gauges.items():
+                family.add_metric([name], stats.get(stat, 0))
+            for stat, family in counters.items():
+                family.add_metric([name], stats.get(stat, 0))
+        yield from gauges.values()
+        yield from counters.values()
+
+
+class ServiceStatsCollector(Collector):
+    """Exports the in-process stats objects (caches, HTTP clients, streams) at scrape time."""
+    def describe(self):
+        # Registration would otherwise call collect(), importing app.services.llm while it imports us
+        return []
+
+    def collect(self):
+        from app.services.answer_cache import answer_cache
+        from app.services.llm import http_clients
+        from app.services.llm_cache import llm_cache
+        from app.services.singleflight import flights
+        from app.services.streaming import stream_stats
+
+        lookups = CounterMetricFamily("docnexus_cache_lookups", "Cache lookups", labels=["cache"])
+        hits = CounterMetricFamily("docnexus_cache_hits", "Cache hits", labels=["cache", "tier"])
+        llm = llm_cache.stats
+        lookups.add_metric(["llm"], llm.lookups)
+        hits.add_metric(["llm", "memory"], llm.memory_hits)
+        hits.add_metric(["llm", "redis"], llm.redis_hits)
+        lookups.add_metric(["answer"], answer_cache.stats.lookups)
+        hits.add_metric(["answer", "memory"], answer_cache.stats.hits)
+        yield lookups
+        yield hits
+
+        requests = CounterMetricFamily("docnexus_provider_requests", "HTTP requests to LLM providers", labels=["base_url"])
+        opened = CounterMetricFamily(
+            "docnexus_provider_connections_opened", "New TCP connections to LLM providers", labels=["base_url"]
+        )
+        for base_url, stats in http_clients.stats().items():
+            requests.add_metric([base_url], stats["requests"])
+            opened.add_metric([base_url], stats["connections_opened"])
+        yield requests
+        yield opened
+
+        calls = CounterMetricFamily(
+            "docnexus_singleflight_calls", "Single-flight calls by role (shared = waited for an identical call in flight)", labels=["flight", "role"]
+        )
+        for name, flight in flights.items():
+            calls.add_metric([name, "leader"], flight.stats.leaders)
+            calls.add_metric([name, "shared"], flight.stats.shared)
+            calls.add_metric([name, "remote_shared"], flight.stats.remote_shared)
+        yield calls
+
+        streams = CounterMetricFamily("docnexus_chat_streams", "Finished /chat streams", labels=["outcome"])
+        streams.add_metric(["completed"], stream_stats.completed)
+        streams.add_metric(["cancelled"], stream_stats.cancelled)
+        yield streams
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+REGISTRY.register(ServiceStatsCollector())
@@ -0,0 +1,22 @@
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(sort_value: datetime, tie_breaker) -> str:
+    """Opaque keyset cursor for the last row of a page: (sort column, unique tie-breaker)."""
+    raw = json.dumps([sort_value.isoformat(), tie_breaker])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, object]:
+    """Raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, tie_breaker = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(sort_value), tie_breaker
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
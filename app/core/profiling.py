@@ -0,0 +1,132 @@
+"""
+Opt-in sampling profiler (pyinstrument) for single requests and Celery tasks.
+
+Nothing here runs unless PROFILING_ENABLED is set: the middleware and the Celery
+signal handlers are only installed then, and pyinstrument is imported lazily.
+A request is profiled when it sends "X-Profile: <PROFILING_TOKEN>" or is picked by
+PROFILING_SAMPLE_RATE. The profile covers the whole ASGI call, so for /chat it
+includes streaming the response (event_stream and the graph run behind it).
+"""
+import asyncio
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+
+from app.core.config import settings
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Id of the profile the current request is recorded under (None when not profiling)
+current_profile_id: ContextVar[str | None] = ContextVar("current_profile_id", default=None)
+
+# Running Celery task profiles by task id
+_task_profilers = {}
+
+
+@lru_cache()
+def _profiler_class():
+    try:
+        from pyinstrument import Profiler
+        return Profiler
+    except ImportError:
+        print("⚠️ PROFILING_ENABLED is set but 'pyinstrument' is not installed, profiling is off")
+        return None
+
+
+def _safe_name(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", text).strip("-")[:80] or "root"
+
+
+def _sampled(rate: float) -> bool:
+    return rate > 0 and random.random() < rate
+
+
+def write_profile(profiler, name: str) -> Path:
+    """Render a stopped profiler to PROFILING_DIR (speedscope JSON or pyinstrument HTML)."""
+    if settings.PROFILING_FORMAT == "html":
+        from pyinstrument.renderers import HTMLRenderer
+        renderer, suffix = HTMLRenderer(), ".html"
+    else:
+        from pyinstrument.renderers import SpeedscopeRenderer
+        renderer, suffix = SpeedscopeRenderer(), ".speedscope.json"
+
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}_{name}{suffix}"
+    path.write_text(profiler.output(renderer=renderer), encoding="utf-8")
+    return path
+
+
+def profile_task_headers() -> dict:
+    """Celery message headers that make a task enqueued by a profiled request profile itself too."""
+    profile_id = current_profile_id.get()
+    return {"profile": profile_id} if profile_id else {}
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware, so a streamed body is profiled until its last chunk is sent."""
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_profile(self, headers: dict) -> bool:
+        token = settings.PROFILING_TOKEN
+        if token and headers.get(PROFILE_HEADER, b"").decode() == token:
+            return True
+        return _sampled(settings.PROFILING_SAMPLE_RATE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not self._wants_profile(headers) or (profiler_class := _profiler_class()) is None:
+            return await self.app(scope, receive, send)
+
+        request_id = headers.get(REQUEST_ID_HEADER, b"").decode()
+        profile_id = _safe_name(request_id) if request_id else uuid.uuid4().hex[:12]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        profiler = profiler_class(interval=settings.PROFILING_INTERVAL_SECONDS, async_mode="enabled")
+        token = current_profile_id.set(profile_id)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            current_profile_id.reset(token)
+            name = f"{scope['method']}_{_safe_name(scope['path'])}_{profile_id}"
+            path = await asyncio.to_thread(write_profile, profiler, name)
+            print(f"🔬 Profile of {scope['method']} {scope['path']} written to {path}")
+
+
+def start_task_profile(task_id: str, task, **kwargs):
+    """Celery task_prerun handler."""
+    requested = getattr(task.request, "profile", None) or (task.request.headers or {}).get("profile")
+    if not (requested or _sampled(settings.PROFILING_TASK_SAMPLE_RATE)):
+        return
+    profiler_class = _profiler_class()
+    if profiler_class is None:
+        return
+    profiler = profiler_class(interval=settings.PROFILING_INTERVAL_SECONDS, async_mode="disabled")
+    profiler.start()
+    _task_profilers[task_id] = (profiler, requested or task_id)
+
+
+def stop_task_profile(task_id: str, task, **kwargs):
+    """Celery task_postrun handler."""
+    entry = _task_profilers.pop(task_id, None)
+    if entry is None:
+        return
+    profiler, profile_id = entry
+    profiler.stop()
+    path = write_profile(profiler, f"task_{_safe_name(task.name)}_{_safe_name(profile_id)}")
+    print(f"🔬 Profile of task {task.name} written to {path}")
@@ -0,0 +1,38 @@
+import time
+from functools import lru_cache
+
+import redis
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+
+
+@lru_cache()
+def get_redis() -> redis.Redis:
+    """Shared sync client (Celery workers, scripts)."""
+    return redis.Redis.from_url(settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+
+
+@lru_cache()
+def get_async_redis() -> aioredis.Redis:
+    """Shared async client for the API."""
+    return aioredis.Redis.from_url(settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+
+
+class RedisBackoff:
+    """
+    Stops using Redis for REDIS_BACKOFF_SECONDS after an error, so an outage costs one
+    timeout per window instead of one per call. `fallback` says what happens meanwhile.
+    """
+    def __init__(self, name: str, fallback: str):
+        self.name = name
+        self.fallback = fallback
+        self._down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def failed(self, e: Exception):
+        print(f"⚠️ {self.name}: Redis unavailable, {self.fallback} for {settings.REDIS_BACKOFF_SECONDS:g}s: {e}")
+        self._down_until = time.monotonic() + settings.REDIS_BACKOFF_SECONDS
@@ -1,12 +1,21 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from psycopg_pool import AsyncConnectionPool
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver 
 
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
 from app.core.config import settings
+from app.core.metrics import pool_collector
+from app.core.profiling import ProfilingMiddleware
 from app.api.router import api_router
+from app.core.database import run_migrations
 from app.services.vector_store import get_vector_store_service
+from app.services.graph.graph import build_rag_graph
+from app.services.llm import http_clients
+from app.services.llm_cache import llm_cache
+from app.services.singleflight import flights
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -24,15 +33,21 @@ async def lifespan(app: FastAPI):
     try:
         app.state.pool = AsyncConnectionPool(
             conninfo=settings.DB_URI,
-            max_size=20,
+            max_size=settings.DB_POOL_MAX_SIZE,
             kwargs={"autocommit": True, "prepare_threshold": None},
             open=False
         )
         await app.state.pool.open()
+        pool_collector.add("api", lambda: getattr(app.state, "pool", None))
         
         # 3. Setup Checkpointer (Create tables if not exist)
         checkpointer = AsyncPostgresSaver(app.state.pool)
         await checkpointer.setup()
+        await run_migrations(app.state.pool)
+
+        # 4. Compile the RAG graph once; per-request data goes through config / UserContext
+        app.state.checkpointer = checkpointer
+        app.state.rag_graph = build_rag_graph(checkpointer)
         
         print("✅ All systems ready!")
         
@@ -48,6 +63,7 @@ async def lifespan(app: FastAPI):
         print("🛑 Shutting down...")
         if hasattr(app.state, "pool"):
             await app.state.pool.close()
+        await http_clients.aclose()
         print("👋 Goodbye!")
 
 # Initialize the app with the lifespan logic
@@ -60,11 +76,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Profile-Id"],
 )
 
+# Outermost, so the profile spans the whole request including the streamed body
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Register your routes
 app.include_router(api_router)
 
 @app.get("/")
 def health_check():
-    return {"status": "running", "env": "production"}
\ No newline at end of file
+    return {"status": "running", "env": "production"}
+
+@app.get("/stats/providers")
+def provider_stats():
+    """Requests and connection reuse of the shared LLM / embedding HTTP clients."""
+    return http_clients.stats()
+
+@app.get("/stats/llm-cache")
+def llm_cache_stats():
+    """Hit rate of the exact-match cache for grader / rewriter / summary calls (this process)."""
+    return {"nodes": settings.LLM_CACHE_NODES, **llm_cache.stats.as_dict()}
+
+@app.get("/stats/singleflight")
+def singleflight_stats():
+    """How many identical concurrent embeddings / searches / LLM calls shared one call (this process)."""
+    return {name: flight.stats.as_dict() for name, flight in flights.items()}
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Prometheus scrape endpoint."""
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
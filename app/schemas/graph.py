@@ -6,4 +6,18 @@ class GradeDocuments(BaseModel):
     
     binary_score: Literal["yes", "no"] = Field(
         description="Relevance score: 'yes' if relevant, or 'no' if not relevant"
-    )
\ No newline at end of file
+    )
+
+class GradeChunks(BaseModel):
+    """Grade a numbered group of retrieved chunks individually."""
+
+    relevant_chunks: list[int] = Field(
+        default_factory=list,
+        description="Numbers of the chunks that are relevant to the question (empty list if none are)"
+    )
+class QueryVariants(BaseModel):
+    """Alternative search queries for a question whose first retrieval failed."""
+
+    rewrite: str = Field(description="The question rewritten to be more specific and technical")
+    keywords: str = Field(description="3-4 distinct keywords/entities from the question, space separated")
+    entities: str = Field(description="Only the dates and proper nouns from the question")
@@ -0,0 +1,262 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+from app.core.redis import RedisBackoff, get_async_redis
+
+# Outcomes of a single admission attempt
+ADMITTED = "admitted"
+USER_FULL = "user_limit"
+GLOBAL_FULL = "global_limit"
+
+# Slots are sorted sets of ticket ids scored by lease expiry, so slots of a crashed
+# instance (or a stream that never released) disappear after ADMISSION_LEASE_SECONDS.
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[4]) then return 1 end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[5]) then return 2 end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+redis.call('PEXPIRE', KEYS[2], ARGV[6])
+return 0
+"""
+ACQUIRE_RESULTS = {0: ADMITTED, 1: USER_FULL, 2: GLOBAL_FULL}
+
+
+class LocalSlots:
+    """In-process slot table: {user_id: {ticket: lease expiry}}."""
+    def __init__(self):
+        self._slots: dict[str, dict[str, float]] = {}
+        self._total = 0
+
+    def _purge(self, now: float):
+        for user_id in list(self._slots):
+            leases = self._slots[user_id]
+            for ticket in [t for t, expiry in leases.items() if expiry <= now]:
+                del leases[ticket]
+                self._total -= 1
+            if not leases:
+                del self._slots[user_id]
+
+    async def try_acquire(self, user_id: str, ticket: str, user_limit: int, global_limit: int) -> str:
+        now = time.monotonic()
+        self._purge(now)
+        if len(self._slots.get(user_id, ())) >= user_limit:
+            return USER_FULL
+        if self._total >= global_limit:
+            return GLOBAL_FULL
+        self._slots.setdefault(user_id, {})[ticket] = now + settings.ADMISSION_LEASE_SECONDS
+        self._total += 1
+        return ADMITTED
+
+    async def user_count(self, user_id: str) -> int:
+        self._purge(time.monotonic())
+        return len(self._slots.get(user_id, ()))
+
+    async def release(self, user_id: str, ticket: str):
+        leases = self._slots.get(user_id, {})
+        if leases.pop(ticket, None) is not None:
+            self._total -= 1
+        if not leases:
+            self._slots.pop(user_id, None)
+
+
+class RedisSlots:
+    """Slot table shared by every API instance."""
+    def __init__(self, name: str):
+        self.global_key = f"admission:{name}:global"
+        self.user_key = f"admission:{name}:user:{{user_id}}"
+
+    async def try_acquire(self, user_id: str, ticket: str, user_limit: int, global_limit: int) -> str:
+        now = time.time()
+        lease = settings.ADMISSION_LEASE_SECONDS
+        result = await get_async_redis().eval(
+            ACQUIRE_SCRIPT, 2, self.global_key, self.user_key.format(user_id=user_id),
+            now, now + lease, ticket, user_limit, global_limit, int(lease * 1000)
+        )
+        return ACQUIRE_RESULTS[int(result)]
+
+    async def user_count(self, user_id: str) -> int:
+        key = self.user_key.format(user_id=user_id)
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zcard(key)
+            _, count = await pipe.execute()
+        return int(count)
+
+    async def release(self, user_id: str, ticket: str):
+        client = get_async_redis()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.zrem(self.global_key, ticket)
+            pipe.zrem(self.user_key.format(user_id=user_id), ticket)
+            await pipe.execute()
+
+
+class Ticket:
+    """A held slot. release() is idempotent, so every exit path can call it."""
+    def __init__(self, controller: "AdmissionController", user_id: str, ticket: str, backend):
+        self.controller = controller
+        self.user_id = user_id
+        self.ticket = ticket
+        self.backend = backend
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        await self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Admission control for one kind of work (chat streams, uploads).
+    A user over their own limit is turned away at once; when the global cap is reached,
+    requests wait in a bounded FIFO queue for up to `queue_timeout` seconds; while anyone
+    is queued, newcomers join the back of it instead of grabbing a freed slot. Rejections are
+    429s whose Retry-After is estimated from how long slots are currently held.
+    With ADMISSION_BACKEND=redis the counts are shared by all instances; if Redis is
+    unreachable the local table takes over.
+    """
+    def __init__(self, name: str, user_limit: int, global_limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.user_limit = user_limit
+        self.global_limit = global_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.local = LocalSlots()
+        self.redis = RedisSlots(name) if settings.ADMISSION_BACKEND == "redis" else None
+        self._redis = RedisBackoff(f"Admission '{name}'", "using local limits")
+        # One event per queued request; only the head of the queue tries for a slot
+        self._queue: deque[asyncio.Event] = deque()
+        self._avg_hold_seconds = 1.0
+
+    def _backend(self):
+        if self.redis and self._redis.available:
+            return self.redis
+        return self.local
+
+    async def _try(self, user_id: str, ticket: str):
+        backend = self._backend()
+        try:
+            return await backend.try_acquire(user_id, ticket, self.user_limit, self.global_limit), backend
+        except Exception as e:
+            if backend is self.local:
+                raise
+            self._redis.failed(e)
+            return await self.local.try_acquire(user_id, ticket, self.user_limit, self.global_limit), self.local
+
+    async def _user_full(self, user_id: str) -> bool:
+        backend = self._backend()
+        try:
+            return await backend.user_count(user_id) >= self.user_limit
+        except Exception as e:
+            if backend is self.local:
+                raise
+            self._redis.failed(e)
+            return await self.local.user_count(user_id) >= self.user_limit
+
+    def _reject(self, reason: str, detail: str):
+        ADMISSION_REJECTED.labels(name=self.name, reason=reason).inc()
+        # Roughly when a slot should free up for everyone queued ahead of this client
+        retry_after = self._avg_hold_seconds * (len(self._queue) + 1) / max(self.global_limit, 1)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(min(max(math.ceil(retry_after), 1), 60))},
+        )
+
+    async def acquire(self, user_id: str) -> Ticket:
+        """Take a slot for `user_id` or raise a 429 HTTPException."""
+        ticket = uuid.uuid4().hex
+        # Only try right away when nobody is queued, so freed slots go to the queue in order
+        if not self._queue:
+            result, backend = await self._try(user_id, ticket)
+            if result == USER_FULL:
+                self._reject(USER_FULL, f"Too many concurrent {self.name} requests for this user")
+            if result == ADMITTED:
+                return Ticket(self, user_id, ticket, backend)
+        elif await self._user_full(user_id):
+            # Queued requests are served in order, but one over its own limit never would be
+            self._reject(USER_FULL, f"Too many concurrent {self.name} requests for this user")
+
+        if len(self._queue) >= self.queue_size:
+            self._reject("queue_full", "Server is busy, please retry")
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        turn = asyncio.Event()
+        self._queue.append(turn)
+        if self._queue[0] is turn:
+            turn.set()  # a slot may have been freed since we tried
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject("queue_timeout", "Server is busy, please retry")
+                # Local releases wake the head right away; it also polls for slots freed by other instances
+                try:
+                    await asyncio.wait_for(turn.wait(), min(remaining, settings.ADMISSION_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                if self._queue[0] is not turn:
+                    continue
+                turn.clear()
+                result, backend = await self._try(user_id, ticket)
+                if result == USER_FULL:
+                    self._reject(USER_FULL, f"Too many concurrent {self.name} requests for this user")
+                if result == ADMITTED:
+                    ADMISSION_WAIT_SECONDS.labels(name=self.name).observe(time.monotonic() - started)
+                    return Ticket(self, user_id, ticket, backend)
+        finally:
+            self._queue.remove(turn)
+            # The next request in line gets its turn (more than one slot may be free)
+            self._wake_head()
+
+    def _wake_head(self):
+        if self._queue:
+            self._queue[0].set()
+
+    async def _release(self, ticket: Ticket):
+        held = time.monotonic() - ticket.acquired_at
+        self._avg_hold_seconds = 0.9 * self._avg_hold_seconds + 0.1 * held
+        try:
+            await ticket.backend.release(ticket.user_id, ticket.ticket)
+        except Exception as e:
+            # The Redis lease expires the slot eventually
+            print(f"⚠️ Admission '{self.name}': failed to release slot: {e}")
+        self._wake_head()
+
+
+async def release_when_done(ticket: Ticket, frames):
+    """Hold `ticket` for as long as a streamed response is being produced."""
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        await ticket.release()
+
+
+chat_admission = AdmissionController(
+    "chat",
+    user_limit=settings.CHAT_MAX_STREAMS_PER_USER,
+    global_limit=settings.CHAT_MAX_STREAMS,
+    queue_size=settings.CHAT_QUEUE_SIZE,
+    queue_timeout=settings.CHAT_QUEUE_TIMEOUT_SECONDS,
+)
+
+upload_admission = AdmissionController(
+    "upload",
+    user_limit=settings.UPLOAD_MAX_PER_USER,
+    global_limit=settings.UPLOAD_MAX_IN_FLIGHT,
+    queue_size=settings.UPLOAD_QUEUE_SIZE,
+    queue_timeout=settings.UPLOAD_QUEUE_TIMEOUT_SECONDS,
+)
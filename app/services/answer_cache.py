@@ -0,0 +1,149 @@
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.redis import RedisBackoff, get_redis, get_async_redis
+
+CORPUS_VERSION_KEY = "answer_cache:corpus_version:{user_id}"
+
+
+@dataclass
+class CacheEntry:
+    corpus_version: int
+    embedding: np.ndarray  # L2-normalised query embedding
+    query: str
+    answer: str
+    cost_seconds: float    # how long the graph took to produce the answer
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class CacheStats:
+    lookups: int = 0
+    hits: int = 0
+    saved_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+def _normalise(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def bump_corpus_version(user_id: str):
+    """Invalidate a user's cached answers from a sync context (Celery ingestion)."""
+    try:
+        get_redis().incr(CORPUS_VERSION_KEY.format(user_id=user_id))
+    except Exception as e:
+        print(f"⚠️ Answer cache: could not bump corpus version for {user_id}: {e}")
+
+
+class SemanticAnswerCache:
+    """
+    Per-tenant answer cache keyed by (user_id, corpus version, query embedding).
+    Entries live in process memory; the corpus version lives in Redis so that
+    ingestion in a Celery worker invalidates answers in every API process.
+    Without Redis that invalidation can't be seen, so the cache is bypassed (and
+    emptied) until Redis is back.
+    """
+    def __init__(self):
+        self._entries: dict[str, deque[CacheEntry]] = defaultdict(
+            lambda: deque(maxlen=settings.ANSWER_CACHE_MAX_ENTRIES_PER_USER)
+        )
+        self._redis = RedisBackoff("Answer cache", "cache bypassed")
+        self.stats = CacheStats()
+
+    def _redis_failed(self, e: Exception):
+        self._redis.failed(e)
+        # Ingestion may bump versions we can't see meanwhile
+        self._entries.clear()
+
+    async def corpus_version(self, user_id: str) -> int | None:
+        """The user's corpus version, or None while Redis is unavailable."""
+        if not self._redis.available:
+            return None
+        try:
+            value = await get_async_redis().get(CORPUS_VERSION_KEY.format(user_id=user_id))
+            return int(value or 0)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+    async def embed(self, query: str) -> np.ndarray:
+        # Imported here so Celery workers can bump versions without loading the vector store
+        from app.services.vector_store import get_vector_store_service
+        embeddings = get_vector_store_service().embeddings
+        return _normalise(await embeddings.aembed_query(query))
+
+    async def lookup(self, user_id: str, query: str) -> tuple[CacheEntry | None, np.ndarray, int] | None:
+        """
+        Returns (entry or None, query embedding, corpus version), or None if the cache
+        can't be used right now (the answer must then not be stored either).
+        The embedding and version are handed back so a miss can be stored without recomputing them.
+        """
+        version = await self.corpus_version(user_id)
+        if version is None:
+            return None
+        embedding = await self.embed(query)
+        self.stats.lookups += 1
+
+        entries = self._entries.get(user_id)
+        if not entries:
+            return None, embedding, version
+
+        # Drop answers from an older corpus or past their TTL
+        now = time.time()
+        fresh = [
+            e for e in entries
+            if e.corpus_version == version and now - e.created_at < settings.ANSWER_CACHE_TTL_SECONDS
+        ]
+        if len(fresh) != len(entries):
+            entries.clear()
+            entries.extend(fresh)
+        if not fresh:
+            return None, embedding, version
+
+        scores = np.stack([e.embedding for e in fresh]) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < settings.ANSWER_CACHE_THRESHOLD:
+            return None, embedding, version
+
+        entry = fresh[best]
+        self.stats.hits += 1
+        self.stats.saved_seconds += entry.cost_seconds
+        print(f"🎯 Answer cache hit (similarity={scores[best]:.3f}, saved ~{entry.cost_seconds:.2f}s) "
+              f"| hit rate {self.stats.as_dict()['hit_rate']:.1%}")
+        return entry, embedding, version
+
+    def store(self, user_id: str, query: str, embedding: np.ndarray, version: int, answer: str, cost_seconds: float):
+        if not answer.strip():
+            return
+        self._entries[user_id].append(CacheEntry(
+            corpus_version=version,
+            embedding=embedding,
+            query=query,
+            answer=answer,
+            cost_seconds=cost_seconds,
+        ))
+
+    async def invalidate(self, user_id: str):
+        """Called when the user's corpus changes (new uploads)."""
+        self._entries.pop(user_id, None)
+        try:
+            await get_async_redis().incr(CORPUS_VERSION_KEY.format(user_id=user_id))
+        except Exception as e:
+            print(f"⚠️ Answer cache: could not bump corpus version for {user_id}: {e}")
+
+
+answer_cache = SemanticAnswerCache()
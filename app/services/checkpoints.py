@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from app.core.config import settings
+from app.services.dbservice import file_db
+
+# Only idle threads are touched, so a run that is writing its next checkpoint (blobs
+# first) is never compacted under it. Walked in keyset order on idx_threads_updated.
+FIND_IDLE_THREADS = """
+    SELECT thread_id, updated_at
+    FROM threads
+    WHERE updated_at < NOW() - make_interval(secs => %s)
+      AND (updated_at, thread_id) > (%s, %s)
+    ORDER BY updated_at, thread_id
+    LIMIT %s
+"""
+
+# Which of those threads have more checkpoints than we keep (primary key lookups only)
+FIND_COMPACTABLE_THREADS = """
+    SELECT thread_id, checkpoint_ns
+    FROM checkpoints
+    WHERE thread_id = ANY(%s)
+    GROUP BY thread_id, checkpoint_ns
+    HAVING count(*) > %s
+    ORDER BY thread_id, checkpoint_ns
+"""
+
+DELETE_OLD_CHECKPOINTS = """
+    DELETE FROM checkpoints
+    WHERE thread_id = %s AND checkpoint_ns = %s
+      AND checkpoint_id NOT IN (
+          SELECT checkpoint_id FROM checkpoints
+          WHERE thread_id = %s AND checkpoint_ns = %s
+          ORDER BY checkpoint_id DESC
+          LIMIT %s
+      )
+    RETURNING checkpoint_id
+"""
+
+DELETE_ORPHANED_WRITES = """
+    DELETE FROM checkpoint_writes
+    WHERE thread_id = %s AND checkpoint_ns = %s AND checkpoint_id = ANY(%s)
+"""
+
+# Blobs are shared between checkpoints (a channel keeps its version until it changes),
+# so a blob goes only when no remaining checkpoint references its version.
+DELETE_ORPHANED_BLOBS = """
+    DELETE FROM checkpoint_blobs b
+    WHERE b.thread_id = %s AND b.checkpoint_ns = %s
+      AND NOT EXISTS (
+          SELECT 1
+          FROM checkpoints c, jsonb_each_text(c.checkpoint -> 'channel_versions') AS v(channel, version)
+          WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+            AND v.channel = b.channel AND v.version = b.version
+      )
+"""
+
+THREAD_STORAGE_STATS = """
+    SELECT
+        (SELECT count(*) FROM checkpoints WHERE thread_id = %(t)s) AS checkpoints,
+        (SELECT coalesce(sum(pg_column_size(checkpoint) + pg_column_size(metadata)), 0)
+           FROM checkpoints WHERE thread_id = %(t)s) AS checkpoint_bytes,
+        (SELECT count(*) FROM checkpoint_blobs WHERE thread_id = %(t)s) AS blobs,
+        (SELECT coalesce(sum(octet_length(blob)), 0) FROM checkpoint_blobs WHERE thread_id = %(t)s) AS blob_bytes,
+        (SELECT count(*) FROM checkpoint_writes WHERE thread_id = %(t)s) AS writes,
+        (SELECT coalesce(sum(octet_length(blob)), 0) FROM checkpoint_writes WHERE thread_id = %(t)s) AS write_bytes
+"""
+
+
+def compact_thread(conn, thread_id: str, checkpoint_ns: str, keep_last: int) -> dict:
+    """Drop all but the newest `keep_last` checkpoints of one thread, with their writes and blobs."""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(DELETE_OLD_CHECKPOINTS, (thread_id, checkpoint_ns, thread_id, checkpoint_ns, keep_last))
+            removed = [row["checkpoint_id"] for row in cur.fetchall()]
+            cur.execute(DELETE_ORPHANED_WRITES, (thread_id, checkpoint_ns, removed))
+            writes = cur.rowcount
+            cur.execute(DELETE_ORPHANED_BLOBS, (thread_id, checkpoint_ns))
+            blobs = cur.rowcount
+    return {"checkpoints": len(removed), "writes": writes, "blobs": blobs}
+
+
+def compact_checkpoints(keep_last: int = None, batch_size: int = None, max_threads: int = None) -> dict:
+    """
+    Compact every idle thread that has more than `keep_last` checkpoints.
+    Idle threads are read in keyset-ordered batches, only their checkpoints are counted,
+    and each one is compacted in its own short transaction, so locks are only ever held
+    on a single thread's rows.
+    """
+    keep_last = max(keep_last or settings.CHECKPOINT_KEEP_LAST, 1)
+    batch_size = batch_size or settings.CHECKPOINT_COMPACTION_BATCH
+    max_threads = max_threads or settings.CHECKPOINT_COMPACTION_MAX_THREADS
+
+    totals = {"threads": 0, "checkpoints": 0, "writes": 0, "blobs": 0}
+    last = (datetime.min, "")
+    with file_db.get_connection() as conn:
+        while totals["threads"] < max_threads:
+            with conn.cursor() as cur:
+                cur.execute(FIND_IDLE_THREADS, (settings.CHECKPOINT_COMPACTION_IDLE_SECONDS, *last, batch_size))
+                idle = cur.fetchall()
+                if not idle:
+                    break
+                cur.execute(FIND_COMPACTABLE_THREADS, ([row["thread_id"] for row in idle], keep_last))
+                batch = cur.fetchall()
+
+            for row in batch[:max_threads - totals["threads"]]:
+                removed = compact_thread(conn, row["thread_id"], row["checkpoint_ns"], keep_last)
+                totals["threads"] += 1
+                for key, count in removed.items():
+                    totals[key] += count
+            last = (idle[-1]["updated_at"], idle[-1]["thread_id"])
+
+    return totals
+
+
+async def get_thread_storage_stats(pool: AsyncConnectionPool, thread_id: str) -> dict:
+    """Row counts and payload bytes the checkpointer stores for one thread."""
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(THREAD_STORAGE_STATS, {"t": thread_id})
+            stats = await cur.fetchone()
+    stats["total_bytes"] = stats["checkpoint_bytes"] + stats["blob_bytes"] + stats["write_bytes"]
+    return stats
@@ -1,27 +1,142 @@
-import psycopg
+import os
+import threading
 from psycopg.rows import dict_row
 from psycopg.types.json import Json
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 from app.core.config import settings
+from app.core.metrics import pool_collector
 from datetime import datetime
 
+# --- Shared query definitions (used by both the sync and async services) ---
+
+FILE_COLUMNS = """id, user_id, filename, file_path, file_size, status, stage,
+                  job_stats, error_message, created_at, updated_at"""
+
+CREATE_FILE_RECORD = """
+    INSERT INTO user_files (user_id, filename, file_path, file_size, status, stage, job_stats)
+    VALUES (%s, %s, %s, %s, 'processing', 'queued', '{}')
+    RETURNING id
+"""
+
+# One multi-row INSERT for a whole upload batch. WITH ORDINALITY + ORDER BY keeps the
+# generated ids in the same order as the input arrays.
+CREATE_FILE_RECORDS = """
+    INSERT INTO user_files (user_id, filename, file_path, file_size, status, stage, job_stats)
+    SELECT %s::uuid, f.filename, f.file_path, f.file_size, 'processing', 'queued', '{}'
+    FROM unnest(%s::text[], %s::text[], %s::bigint[]) WITH ORDINALITY AS f(filename, file_path, file_size, ord)
+    ORDER BY f.ord
+    RETURNING id
+"""
+
+UPDATE_PROGRESS = """
+    UPDATE user_files
+    SET stage = %s,
+        status = %s,
+        job_stats = %s,
+        updated_at = %s
+    WHERE id = %s
+"""
+
+MARK_FAILED = """
+    UPDATE user_files
+    SET status = 'failed', error_message = %s, updated_at = %s
+    WHERE id = %s
+"""
+
+GET_FILE_BY_NAME = f"""
+    SELECT {FILE_COLUMNS}
+    FROM user_files
+    WHERE user_id = %s AND filename = %s
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+# Keyset pagination, served by idx_user_files_user_created (user_id, created_at DESC, id DESC)
+GET_USER_FILES = f"""
+    SELECT {FILE_COLUMNS}
+    FROM user_files
+    WHERE user_id = %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+GET_USER_FILES_AFTER = f"""
+    SELECT {FILE_COLUMNS}
+    FROM user_files
+    WHERE user_id = %s AND (created_at, id) < (%s, %s)
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+GET_FILE_METADATA = f"""
+    SELECT {FILE_COLUMNS}
+    FROM user_files
+    WHERE id = %s AND user_id = %s
+"""
+
+GET_FILE_BY_ID = """
+    SELECT id, user_id, filename, file_path, status, stage,
+        job_stats, error_message, created_at, updated_at
+    FROM user_files
+    WHERE id = %s
+"""
+
+
 class FileDBService:
+    """
+    Sync variant for Celery workers.
+    Connections come from a psycopg ConnectionPool that is opened lazily per process,
+    so pools are never shared across a prefork.
+    """
     def __init__(self):
-        # Synchronous connection string for Celery
         self.dsn = settings.DB_URI
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ConnectionPool:
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ConnectionPool(
+                        conninfo=self.dsn,
+                        min_size=1,
+                        max_size=settings.WORKER_DB_POOL_MAX_SIZE,
+                        kwargs={"autocommit": True, "row_factory": dict_row},
+                        open=True
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
 
     def get_connection(self):
-        return psycopg.connect(self.dsn, row_factory=dict_row, autocommit=True)
+        return self.pool.connection()
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.close()
+        self._pool = None
 
     def create_file_record(self, user_id: str, filename: str, path: str, file_size: str):
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO user_files (user_id, filename, file_path, file_size, status, stage, job_stats)
-                    VALUES (%s, %s, %s, %s, 'processing', 'queued', '{}')
-                    RETURNING id
-                """, (user_id, filename, str(path), file_size))
+                cur.execute(CREATE_FILE_RECORD, (user_id, filename, str(path), file_size))
                 return cur.fetchone()['id']
 
+    def create_file_records(self, user_id: str, records: list[tuple[str, str, int]]) -> list[int]:
+        """
+        Register a batch of uploads in a single INSERT / transaction.
+        `records` is a list of (filename, path, file_size); ids are returned in the same order.
+        """
+        if not records:
+            return []
+        filenames, paths, sizes = (list(col) for col in zip(*records))
+        with self.get_connection() as conn:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute(CREATE_FILE_RECORDS, (user_id, filenames, [str(p) for p in paths], sizes))
+                    return sorted(row['id'] for row in cur.fetchall())
+
     def update_progress(self, file_id: int, stage: str, status: str = 'processing', job_stats: dict = None):
         """
         Updates the stage and dumps the full stats dictionary into JSONB
@@ -29,52 +144,34 @@ class FileDBService:
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 # We use Json(job_stats) to ensure it serializes correctly for Postgres
-                cur.execute("""
-                    UPDATE user_files 
-                    SET stage = %s, 
-                        status = %s, 
-                        job_stats = %s,
-                        updated_at = %s
-                    WHERE id = %s
-                """, (stage, status, Json(job_stats) if job_stats else None, datetime.now(), file_id))
+                cur.execute(UPDATE_PROGRESS, (stage, status, Json(job_stats) if job_stats else None, datetime.now(), file_id))
 
     def mark_failed(self, file_id: int, error: str):
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE user_files 
-                    SET status = 'failed', error_message = %s, updated_at = %s
-                    WHERE id = %s
-                """, (str(error), datetime.now(), file_id))
+                cur.execute(MARK_FAILED, (str(error), datetime.now(), file_id))
 
 
     def get_file_by_name(self, user_id: str, filename: str):
         """Get a single file record by filename"""
-        
+
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, user_id, filename, file_path,file_size,  status, stage, 
-                        job_stats, error_message, created_at, updated_at
-                    FROM user_files
-                    WHERE user_id = %s AND filename = %s
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """, (user_id, filename))
+                cur.execute(GET_FILE_BY_NAME, (user_id, filename))
                 return cur.fetchone()
 
 
-    def get_user_files(self, user_id: str):
-        """Get all files for a user with their metadata"""
+    def get_user_files(self, user_id: str, limit: int, after: tuple = None):
+        """
+        Get one page of files for a user, newest first.
+        `after` is the (created_at, id) of the last row of the previous page.
+        """
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, user_id, filename, file_path, file_size, status, stage, 
-                        job_stats, error_message, created_at, updated_at
-                    FROM user_files
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
+                if after:
+                    cur.execute(GET_USER_FILES_AFTER, (user_id, *after, limit))
+                else:
+                    cur.execute(GET_USER_FILES, (user_id, limit))
                 return cur.fetchall()
 
 
@@ -82,26 +179,90 @@ class FileDBService:
         """Get detailed metadata for a specific file"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, user_id, filename, file_path, file_size, status, stage, 
-                        job_stats, error_message, created_at, updated_at
-                    FROM user_files
-                    WHERE id = %s AND user_id = %s
-                """, (file_id, user_id))
+                cur.execute(GET_FILE_METADATA, (file_id, user_id))
                 return cur.fetchone()
-    
+
     def get_file_by_id(self, file_id: int):
         """Get a single file record by ID"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, user_id, filename, file_path, status, stage, 
-                        job_stats, error_message, created_at, updated_at
-                    FROM user_files
-                    WHERE id = %s
-                """, (file_id,))
+                cur.execute(GET_FILE_BY_ID, (file_id,))
                 return cur.fetchone()
 
 
+class AsyncFileDBService:
+    """
+    Async variant for the API. Uses the shared app.state.pool, so handlers never
+    open their own connections or block the event loop.
+    """
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def create_file_record(self, user_id: str, filename: str, path: str, file_size: str):
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(CREATE_FILE_RECORD, (user_id, filename, str(path), file_size))
+                return (await cur.fetchone())['id']
+
+    async def create_file_records(self, user_id: str, records: list[tuple[str, str, int]]) -> list[int]:
+        """
+        Register a batch of uploads in a single INSERT / transaction.
+        `records` is a list of (filename, path, file_size); ids are returned in the same order.
+        """
+        if not records:
+            return []
+        filenames, paths, sizes = (list(col) for col in zip(*records))
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    await cur.execute(CREATE_FILE_RECORDS, (user_id, filenames, [str(p) for p in paths], sizes))
+                    # Serial ids follow the ORDER BY, so sorting restores input order
+                    return sorted(row['id'] for row in await cur.fetchall())
+
+    async def update_progress(self, file_id: int, stage: str, status: str = 'processing', job_stats: dict = None):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(UPDATE_PROGRESS, (stage, status, Json(job_stats) if job_stats else None, datetime.now(), file_id))
+
+    async def mark_failed(self, file_id: int, error: str):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(MARK_FAILED, (str(error), datetime.now(), file_id))
+
+    async def get_file_by_name(self, user_id: str, filename: str):
+        """Get a single file record by filename"""
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(GET_FILE_BY_NAME, (user_id, filename))
+                return await cur.fetchone()
+
+    async def get_user_files(self, user_id: str, limit: int, after: tuple = None):
+        """
+        Get one page of files for a user, newest first.
+        `after` is the (created_at, id) of the last row of the previous page.
+        """
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                if after:
+                    await cur.execute(GET_USER_FILES_AFTER, (user_id, *after, limit))
+                else:
+                    await cur.execute(GET_USER_FILES, (user_id, limit))
+                return await cur.fetchall()
+
+    async def get_file_metadata(self, file_id: int, user_id: str):
+        """Get detailed metadata for a specific file"""
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(GET_FILE_METADATA, (file_id, user_id))
+                return await cur.fetchone()
+
+    async def get_file_by_id(self, file_id: int):
+        """Get a single file record by ID"""
+        async with self.pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(GET_FILE_BY_ID, (file_id,))
+                return await cur.fetchone()
+
 
-file_db = FileDBService()
\ No newline at end of file
+file_db = FileDBService()
+pool_collector.add("file_db", lambda: file_db._pool)
@@ -0,0 +1,242 @@
+"""
+Deterministic local stand-ins for OpenRouter and Milvus, selected with
+LLM_PROVIDER=fake / VECTOR_STORE_PROVIDER=fake. They let the full RAG graph run
+offline with realistic latencies, for load tests and profiling. Never enable in production.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from app.core.config import settings
+from app.services.singleflight import SingleFlightChatMixin
+
+WORDS = (
+    "revenue margin quarter growth customer contract region product forecast policy "
+    "report invoice payment supplier audit budget segment market risk compliance"
+).split()
+
+
+def _stable_int(text: str) -> int:
+    """Process-independent hash (str hash() is salted per process)."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _is_relevant(text: str) -> bool:
+    return _stable_int(text) % 100 < settings.FAKE_GRADER_RELEVANT_PERCENT
+
+
+def _estimate_tokens(text: str) -> int:
+    # Deliberately not tiktoken, so profiles of fake runs only show our own code
+    return len(text) // 4 + 1
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Scripted chat model. With tools bound it calls them: the retrieval tool gets the
+    latest user question, structured-output schemas (graders, query variants) get
+    deterministic answers. Without tools it streams a canned answer token by token.
+    Latency is FAKE_LLM_TTFT_MS before the first token plus FAKE_LLM_TOKEN_MS per token.
+    """
+    model: str = "fake"
+    temperature: float | None = None
+    max_tokens: int | None = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "docnexus-fake"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model": self.model, "temperature": self.temperature, "max_tokens": self.max_tokens}
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    # --- scripting ---
+
+    def _tool_call(self, tool: dict, messages: list[BaseMessage]) -> dict:
+        name = tool["function"]["name"]
+        prompt = messages[-1].text
+        if name == "GradeDocuments":
+            args = {"binary_score": "yes" if _is_relevant(prompt) else "no"}
+        elif name == "GradeChunks":
+            numbered = re.findall(r"^\[(\d+)\] (.*)$", prompt, flags=re.MULTILINE)
+            args = {"relevant_chunks": [int(n) for n, text in numbered if _is_relevant(text)]}
+        elif name == "QueryVariants":
+            match = re.search(r"Question:\n(.*)", prompt)
+            question = match.group(1) if match else prompt[:200]
+            args = {"rewrite": f"{question} details", "keywords": " ".join(question.split()[:4]), "entities": question}
+        else:
+            question = next((m.text for m in reversed(messages) if isinstance(m, HumanMessage)), prompt)
+            args = {"query": question}
+        call_id = f"call_{_stable_int(name + prompt) % 10**12}"
+        return {"name": name, "args": args, "id": call_id, "type": "tool_call"}
+
+    def _script(self, messages: list[BaseMessage], tools: list[dict] | None) -> AIMessage:
+        prompt_tokens = sum(_estimate_tokens(m.text) for m in messages)
+        if tools:
+            calls = [self._tool_call(tools[0], messages)]
+            content, output_tokens = "", _estimate_tokens(json.dumps(calls[0]["args"]))
+        else:
+            calls = []
+            seed = _stable_int(messages[-1].text)
+            count = min(settings.FAKE_LLM_ANSWER_TOKENS, self.max_tokens or settings.FAKE_LLM_ANSWER_TOKENS)
+            content = " ".join(WORDS[(seed + i) % len(WORDS)] for i in range(count)) + "."
+            output_tokens = count
+        return AIMessage(
+            content=content,
+            tool_calls=calls,
+            response_metadata={"model_name": self.model},
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            },
+        )
+
+    @staticmethod
+    def _pieces(message: AIMessage) -> list[str]:
+        words = message.content.split(" ")
+        return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+    def _total_seconds(self, message: AIMessage) -> float:
+        return (settings.FAKE_LLM_TTFT_MS + settings.FAKE_LLM_TOKEN_MS * message.usage_metadata["output_tokens"]) / 1000
+
+    # --- BaseChatModel ---
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun | None = None,
+                  tools: list[dict] | None = None, **kwargs) -> ChatResult:
+        message = self._script(messages, tools)
+        time.sleep(self._total_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                         tools: list[dict] | None = None, **kwargs) -> ChatResult:
+        message = self._script(messages, tools)
+        await asyncio.sleep(self._total_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> Iterator[ChatGenerationChunk]:
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+                response_metadata=message.response_metadata,
+                usage_metadata=message.usage_metadata,
+            ))
+            return
+        pieces = self._pieces(message)
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=piece,
+                response_metadata=message.response_metadata if last else {},
+                usage_metadata=message.usage_metadata if last else None,
+            ))
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun | None = None,
+                tools: list[dict] | None = None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self._script(messages, tools)
+        time.sleep(settings.FAKE_LLM_TTFT_MS / 1000)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                time.sleep(settings.FAKE_LLM_TOKEN_MS / 1000)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: list[BaseMessage], stop=None,
+                       run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                       tools: list[dict] | None = None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._script(messages, tools)
+        await asyncio.sleep(settings.FAKE_LLM_TTFT_MS / 1000)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                await asyncio.sleep(settings.FAKE_LLM_TOKEN_MS / 1000)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class SingleFlightFakeChatModel(SingleFlightChatMixin, FakeChatModel):
+    """FakeChatModel for temperature-0 calls (see app/services/llm.py)."""
+
+
+def fake_embedding_model() -> DeterministicFakeEmbedding:
+    """Hash-seeded random vectors: the same text always gets the same embedding."""
+    return DeterministicFakeEmbedding(size=settings.FAKE_EMBEDDING_SIZE)
+
+
+class FakeVectorStoreService:
+    """
+    In-memory replacement for VectorStoreService. Every user starts with a synthetic
+    corpus of FAKE_VECTOR_STORE_CHUNKS chunks; searches rank by word overlap and
+    sleep FAKE_VECTOR_STORE_LATENCY_MS like a Milvus round trip would.
+    """
+    max_score = 1.0  # search scores are word-overlap fractions
+
+    def __init__(self):
+        self.embeddings = fake_embedding_model()
+        self._chunks: dict[str, dict[str, Document]] = {}
+        self._lock = threading.Lock()
+
+    def _corpus(self, user_id: str) -> dict[str, Document]:
+        with self._lock:
+            if user_id not in self._chunks:
+                corpus = {}
+                for i in range(settings.FAKE_VECTOR_STORE_CHUNKS):
+                    seed = _stable_int(f"{user_id}:{i}")
+                    text = f"Chunk {i}: " + " ".join(WORDS[(seed >> j) % len(WORDS)] for j in range(60))
+                    pk = f"fake-{i}"
+                    corpus[pk] = Document(
+                        page_content=text,
+                        metadata={"pk": pk, "user_id": user_id, "file_id": 0, "filename": "synthetic.pdf"},
+                    )
+                self._chunks[user_id] = corpus
+            return self._chunks[user_id]
+
+    def _latency(self):
+        time.sleep(settings.FAKE_VECTOR_STORE_LATENCY_MS / 1000)
+
+    def ensure_vectoredb_exists(self):
+        print("🧪 Using the in-memory fake vector store")
+
+    def add_chunks(self, chunks: list[Document]):
+        self._latency()
+        for doc in chunks:
+            corpus = self._corpus(doc.metadata.get("user_id", ""))
+            pk = f"fake-{len(corpus)}"
+            with self._lock:
+                corpus[pk] = Document(page_content=doc.page_content, metadata={**doc.metadata, "pk": pk})
+
+    def search_with_scores(self, user_id: str, query: str, k: int = 20) -> list[tuple[Document, float]]:
+        self._latency()
+        terms = set(query.lower().split())
+        scored = []
+        for doc in self._corpus(user_id).values():
+            overlap = len(terms & set(doc.page_content.lower().split()))
+            scored.append((doc, overlap / (len(terms) or 1)))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return [(Document(page_content=doc.page_content, metadata=dict(doc.metadata)), score) for doc, score in scored[:k]]
+
+    def get_chunk_texts(self, user_id: str, chunk_ids: list[str]) -> dict[str, str]:
+        self._latency()
+        corpus = self._corpus(user_id)
+        return {pk: corpus[pk].page_content for pk in chunk_ids if pk in corpus}
+
+    def get_chunks_by_file_id(self, user_id: str, file_id: int, limit: int = 1000):
+        return [doc for doc in self._corpus(user_id).values() if doc.metadata.get("file_id") == file_id][:limit]
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.metrics import VECTOR_STORE_SECONDS
+from app.services.vector_store import get_vector_store_service
+
+
+class ChunkStore:
+    """
+    (user id, chunk id) -> chunk text, so graph state and tool messages only carry ids.
+    An in-process LRU filled by every search sits in front of Milvus, which stays
+    the source of truth for chunks that were evicted or fetched by another instance.
+    Entries are per user: ids are only unique within a user's collection.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._texts: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._lock = threading.Lock()  # searches run in worker threads
+
+    def put(self, user_id: str, chunk_id: str, text: str):
+        key = (user_id, chunk_id)
+        with self._lock:
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+
+    def put_documents(self, user_id: str, chunk_ids: list[str], docs: list[Document]):
+        for chunk_id, doc in zip(chunk_ids, docs):
+            self.put(user_id, chunk_id, doc.page_content)
+
+    def _cached(self, user_id: str, chunk_ids: list[str]) -> dict[str, str]:
+        with self._lock:
+            found = {}
+            for chunk_id in chunk_ids:
+                key = (user_id, chunk_id)
+                if key in self._texts:
+                    self._texts.move_to_end(key)
+                    found[chunk_id] = self._texts[key]
+            return found
+
+    async def get_many(self, user_id: str, chunk_ids: list[str]) -> dict[str, str]:
+        """Texts for the ids that still exist (missing ones are simply left out)."""
+        found = self._cached(user_id, chunk_ids)
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in found]
+        if missing:
+            try:
+                with VECTOR_STORE_SECONDS.labels(op="fetch").time():
+                    fetched = await asyncio.to_thread(get_vector_store_service().get_chunk_texts, user_id, missing)
+            except Exception as e:
+                print(f"⚠️ Chunk rehydration failed for {len(missing)} chunks: {e}")
+                fetched = {}
+            for chunk_id, text in fetched.items():
+                self.put(user_id, chunk_id, text)
+            found.update(fetched)
+        return found
+
+
+chunk_store = ChunkStore(settings.CHUNK_STORE_MAX_ENTRIES)
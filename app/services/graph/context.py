@@ -0,0 +1,84 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import tiktoken
+from langchain_core.messages import BaseMessage
+
+from app.core.config import settings
+
+# Rough per-message cost of role / separators in the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache()
+def get_encoding():
+    """Load the tokenizer once per process (None if it can't be loaded, e.g. offline)."""
+    try:
+        return tiktoken.get_encoding(settings.CONTEXT_TOKENIZER)
+    except Exception as e:
+        print(f"⚠️ Tokenizer '{settings.CONTEXT_TOKENIZER}' unavailable, estimating tokens: {e}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Token count of a string. Cached, since chunks and old turns are counted on every request."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: BaseMessage) -> int:
+    return count_tokens(message.text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The start of `text`, cut to at most `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+@dataclass
+class PackedContext:
+    chunks: list[str] = field(default_factory=list)
+    first_turn: int = 0  # index of the oldest history turn that still fits
+    tokens: int = 0
+    dropped_chunks: int = 0
+
+
+def pack_context(fixed_tokens: int, chunks: list[str], turns: list[BaseMessage], budget: int) -> PackedContext:
+    """
+    Fill `budget` tokens in priority order: the fixed part (instructions + question) is always
+    kept, then the retrieved chunks in rank order, then the most recent history turns.
+    Turns are kept as a contiguous tail so the conversation stays coherent.
+    """
+    used = fixed_tokens
+    packed = PackedContext(first_turn=len(turns))
+
+    for chunk in chunks:
+        cost = count_tokens(chunk) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            # A smaller, lower ranked chunk may still fit
+            packed.dropped_chunks += 1
+            continue
+        packed.chunks.append(chunk)
+        used += cost
+
+    for index in range(len(turns) - 1, -1, -1):
+        cost = message_tokens(turns[index])
+        if used + cost > budget:
+            break
+        packed.first_turn = index
+        used += cost
+
+    packed.tokens = used
+    return packed
@@ -1,23 +1,38 @@
 from langgraph.graph import StateGraph, START, END,MessagesState
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langchain_core.runnables import RunnableConfig
+from app.core.metrics import observe_node
 from app.services.graph.nodes import RAGState
 from app.services.graph.tools import get_retrievel_tool
 from app.services.graph.nodes import (
     generate_answer,
     generate_query_or_respond, 
     rewrite_question,
-    grade_documents)
+    grade_documents,
+    fanout_retrieve,
+    route_after_grading)
 
 from app.services.graph.tools import UserContext
 
+retrieve_tools = ToolNode([get_retrievel_tool])
+
+
+@observe_node
+async def retrieve(state: RAGState, config: RunnableConfig):
+    """ToolNode behind a plain function node, so it is timed like the others."""
+    return await retrieve_tools.ainvoke(state, config)
+
+
 def build_rag_graph(checkpointer: AsyncPostgresSaver):
     workflow = StateGraph(RAGState, context_schema=UserContext)
 
     # Define the nodes we will cycle between
     workflow.add_node(generate_query_or_respond)
-    workflow.add_node("retrieve", ToolNode([get_retrievel_tool]))
+    workflow.add_node("retrieve", retrieve)
+    workflow.add_node(grade_documents)
     workflow.add_node(rewrite_question)
+    workflow.add_node(fanout_retrieve)
     workflow.add_node(generate_answer)
 
     workflow.add_edge(START, "generate_query_or_respond")
@@ -34,13 +49,13 @@ def build_rag_graph(checkpointer: AsyncPostgresSaver):
         },
     )
 
-    # Edges taken after the `action` node is called.
+    # Grade the retrieved chunks, then answer with the survivors or rewrite
+    workflow.add_edge("retrieve", "grade_documents")
     workflow.add_conditional_edges(
-        "retrieve",
-        # Assess agent decision
-        grade_documents,
-
+        "grade_documents",
+        route_after_grading,
     )
+    workflow.add_edge("fanout_retrieve", "generate_answer")
     workflow.add_edge("generate_answer", END)
     workflow.add_edge("rewrite_question", "generate_query_or_respond")
 
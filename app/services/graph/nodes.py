@@ -1,81 +1,263 @@
-from app.services.graph.tools import get_retrievel_tool
+from app.services.graph.tools import get_retrievel_tool, search_documents, query_similarity, reciprocal_rank_fusion, chunk_id, parse_chunk_refs, CHUNK_SEPARATOR
+from app.services.graph.chunk_store import chunk_store
+from app.services.graph.relevance import relevance_gate, log_gate_decisions
 from app.core.config import settings
-from app.schemas.graph import GradeDocuments 
-from app.core.prompts import ROUTER_SYSTEM_PROMPT, GRADE_DOCUMENTS_PROMPT, REWRITE_PROMPT, ANSWER_INSTURCTION
+from app.schemas.graph import GradeDocuments, GradeChunks, QueryVariants
+from app.services.graph.context import count_tokens, message_tokens, pack_context, truncate_tokens, MESSAGE_OVERHEAD_TOKENS
+from app.core.prompts import ROUTER_SYSTEM_PROMPT, GRADE_DOCUMENTS_PROMPT, GRADE_CHUNKS_PROMPT, REWRITE_PROMPT, FANOUT_QUERIES_PROMPT, ANSWER_INSTURCTION, SUMMARIZE_HISTORY_PROMPT
 
+import asyncio
 from typing import Literal  
 
 from langchain.messages import HumanMessage, SystemMessage, ToolMessage, AIMessage
 from langgraph.graph import MessagesState
-from langchain_openai import ChatOpenAI
+from app.services.llm import chat_model
+from app.services.llm_cache import cache_for
+from app.core.metrics import observe_node
 from langchain_core.runnables import RunnableConfig
 from langgraph.runtime import Runtime #--add again evalv
 from app.services.graph.tools import UserContext #----add again evalv
 
-response_model = ChatOpenAI(base_url= settings.OPEN_ROUTER_BASE_URL, 
-                            model=settings.OPEN_ROUTER_CHAT_LLM, 
-                            api_key = settings.OPEN_ROUTER_API,
-                            max_tokens=1000
-                            )
-grader_model = ChatOpenAI(base_url= settings.OPEN_ROUTER_BASE_URL, 
-                        model=settings.OPEN_ROUTER_CHAT_LLM,
-                        api_key = settings.OPEN_ROUTER_API,
-                        temperature=0).with_structured_output(GradeDocuments)
+# Both models share the provider's pooled HTTP clients (app/services/llm.py)
+response_model = chat_model(max_tokens=1000)
+# Internal calls run at temperature 0 so identical prompts can be answered from the LLM cache
+grader_llm = chat_model(temperature=0, cache=cache_for("grade_documents"))
+grader_model = grader_llm.with_structured_output(GradeDocuments)
+chunk_grader_model = grader_llm.with_structured_output(GradeChunks)
+rewrite_model = chat_model(temperature=0, cache=cache_for("rewrite_question"))
+query_variants_model = chat_model(temperature=0, cache=cache_for("fanout_retrieve")).with_structured_output(QueryVariants)
+summary_model = chat_model(
+    temperature=0, max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS, cache=cache_for("summarize_history")
+)
+# Bind the tools once instead of on every router call
+router_model = response_model.bind_tools([get_retrievel_tool])
 
 class RAGState(MessagesState):
     """Extended state for RAG"""
     rewritten_question: str = ""
     loop_step: int = 0 
+    documents: list[str] = []  # ids of the graded chunks generate_answer uses as context
+    graded_ids: list[str] = []  # chunks already graded for this question (skipped on later loops)
+    summary: str = ""  # rolling summary of the turns that no longer fit the context budget
+    summarized_turns: int = 0  # how many history turns the summary covers
 
+@observe_node
 async def generate_query_or_respond(state: RAGState, runtime: Runtime[UserContext]): 
 #async def generate_query_or_respond(state: RAGState, config: RunnableConfig): #----add again evalv
     """Call the model to generate a response based on the current state."""
 
+    updates = {}
     if state.get("rewritten_question"):
+        search_text = state["rewritten_question"]
         messages = [
             SystemMessage(content=ROUTER_SYSTEM_PROMPT),
             HumanMessage(content=state["rewritten_question"])
         ]
     else:
+        search_text = [m for m in state["messages"] if m.type == "human"][-1].content
         messages = [SystemMessage(content=ROUTER_SYSTEM_PROMPT)] + state["messages"]    
-    
-    response = await (
-        response_model.bind_tools([get_retrievel_tool]).ainvoke(messages)
-    )
+        # New human turn: a previous turn may have ended here without reaching generate_answer,
+        # so its loop count and graded chunks must not carry over
+        updates = {"loop_step": 0, "documents": [], "graded_ids": []}
+
+    # The router nearly always calls the tool, so start searching right away
+    prefetch = None
+    if settings.SPECULATIVE_RETRIEVAL:
+        prefetch = asyncio.create_task(
+            asyncio.to_thread(search_documents, runtime.context.user_id, search_text)
+        )
+
+    try:
+        response = await router_model.ainvoke(messages)
+    except BaseException:
+        if prefetch:
+            _discard(prefetch)
+        raise
+
+    if prefetch:
+        await _use_prefetch(prefetch, search_text, response, runtime.context)
+
+    return {"messages": [response], "rewritten_question": "", **updates}
+
+MAX_RETRIES = 3
+
+async def _grade_chunk_group(question: str, chunks: list[tuple[str, str]], slots: asyncio.Semaphore) -> list[str]:
+    """Grade a small numbered group of (id, text) chunks in one call and return the relevant ids."""
+    numbered = "\n\n".join(f"[{i}] {text}" for i, (_, text) in enumerate(chunks, start=1))
+    prompt = GRADE_CHUNKS_PROMPT.format(question=question, chunks=numbered)
+
+    async with slots:
+        try:
+            response = await chunk_grader_model.ainvoke(
+                [{"role": "user", "content": prompt}],
+                config={"tags": ["internal_grading"]}
+            )
+        except Exception as e:
+            # Don't drop context because a single grader call failed
+            print(f"⚠️ Chunk grading failed, keeping group: {e}")
+            return [cid for cid, _ in chunks]
+
+    keep = set(response.relevant_chunks)
+    return [cid for i, (cid, _) in enumerate(chunks, start=1) if i in keep]
+
+async def grade_chunks(question: str, chunks: dict[str, str]) -> list[str]:
+    """Grade chunks in groups of GRADER_BATCH_SIZE, concurrently (capped by GRADER_CONCURRENCY)."""
+    size = max(settings.GRADER_BATCH_SIZE, 1)
+    slots = asyncio.Semaphore(settings.GRADER_CONCURRENCY)
+    items = list(chunks.items())
+    groups = [items[i:i + size] for i in range(0, len(items), size)]
+
+    results = await asyncio.gather(*(_grade_chunk_group(question, group, slots) for group in groups))
+    return [chunk for group in results for chunk in group]
+
+def _discard(prefetch: asyncio.Task):
+    """Cancel an unused prefetch; if it already finished, retrieve its error so asyncio doesn't log it."""
+    prefetch.cancel()
+    prefetch.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+async def _use_prefetch(prefetch: asyncio.Task, search_text: str, response: AIMessage, context: UserContext):
+    """Hand the speculative results to the tool if the router's query matches, otherwise drop them."""
+    tool_queries = [
+        call["args"].get("query", "")
+        for call in (response.tool_calls or [])
+        if call["name"] == get_retrievel_tool.name
+    ]
+    matches = [q for q in tool_queries if query_similarity(q, search_text) >= settings.SPECULATIVE_MATCH_THRESHOLD]
+
+    if not matches:
+        _discard(prefetch)
+        print("--- SPECULATIVE RETRIEVAL DISCARDED ---")
+        return
+
+    try:
+        docs = await prefetch
+    except Exception as e:
+        # The tool will simply run its own search
+        print(f"⚠️ Speculative retrieval failed: {e}")
+        return
+
+    for query in matches:
+        context.prefetched[query] = docs
+    print(f"--- SPECULATIVE RETRIEVAL REUSED ({len(docs)} docs) ---")
+
+async def _grade(question: str, chunks: dict[str, str]) -> list[str]:
+    """Return the ids of the relevant chunks, per chunk or with one yes/no for the whole context (GRADER_MODE)."""
+    if settings.GRADER_MODE == "per_chunk":
+        relevant = await grade_chunks(question, chunks)
+        print(f"--- GRADED {len(chunks)} CHUNKS: {len(relevant)} RELEVANT ---")
+        return relevant
+
+    prompt = GRADE_DOCUMENTS_PROMPT.format(question=question, context=CHUNK_SEPARATOR.join(chunks.values()))
+    response = await (grader_model.ainvoke(
+        [{"role":"user", "content": prompt,}],
+        config={"tags": ["internal_grading"]}
+    ))
+
+    return list(chunks) if response.binary_score == "yes" else []
+
+async def _gate_and_grade(question: str, chunks: dict[str, str], scores: dict[str, float]) -> list[str]:
+    """
+    Run the relevance gate before the LLM grader (RELEVANCE_GATE). With "on" only the
+    uncertain chunks reach the grader; with "shadow" the grader still sees everything
+    and the gate's decisions are just logged next to its labels.
+    """
+    if settings.RELEVANCE_GATE == "off":
+        return await _grade(question, chunks)
+
+    if settings.RELEVANCE_RERANK:
+        decision = await asyncio.to_thread(relevance_gate, question, chunks, scores)
+    else:
+        decision = relevance_gate(question, chunks, scores)
+
+    if settings.RELEVANCE_GATE == "on":
+        to_grade = {cid: chunks[cid] for cid in decision.uncertain}
+        print(f"--- RELEVANCE GATE: {len(decision.accepted)} accepted, {len(decision.rejected)} rejected, "
+              f"{len(to_grade)} to the grader ---")
+        graded = await _grade(question, to_grade) if to_grade else []
+        keep = set(decision.accepted) | set(graded)
+        relevant = [cid for cid in chunks if cid in keep]
+    else:
+        to_grade = chunks
+        graded = relevant = await _grade(question, chunks)
 
-    # Note: We reset loop_step here IF the model decides NOT to use a tool (i.e. normal chat)
-    # But if it uses a tool, we keep the current loop_step.
-    return {"messages": [response], "rewritten_question": ""}
+    if settings.RELEVANCE_LOG_PATH:
+        await asyncio.to_thread(log_gate_decisions, question, decision, list(to_grade), graded)
+    return relevant
 
-async def grade_documents(state: RAGState) -> Literal["generate_answer", "rewrite_question"]:
-    """Determine whether the retrieved documents are relevant to the question."""
+@observe_node
+async def grade_documents(state: RAGState, runtime: Runtime[UserContext]):
+    """Grade the retrieved chunks and keep only the relevant ones for generate_answer."""
     
     last_human_msg = [m for m in state["messages"] if m.type == "human"][-1]
     question = last_human_msg.content
-    context = state["messages"][-1].content
+    # The tool message only holds chunk references; dedupe them by id
+    refs = parse_chunk_refs(state["messages"][-1].content)
+    chunk_ids = list(dict.fromkeys(ref["id"] for ref in refs))
 
     # 1. Check Loop Limit
     current_loop = state.get("loop_step", 0)
-    MAX_RETRIES = 3 
 
     if current_loop >= MAX_RETRIES:
         print(f"--- LOOP LIMIT REACHED ({current_loop}) ---")
-        return "generate_answer"  
+        return {"documents": chunk_ids}
 
-    # 2. Grade Documents
-    prompt = GRADE_DOCUMENTS_PROMPT.format(question=question, context=context)
-    response = await (grader_model.ainvoke(
-        [{"role":"user", "content": prompt,}],
-        config={"tags": ["internal_grading"]}
-    ))
+    # 2. Grade Documents (chunks already rejected on an earlier loop are not graded again)
+    graded = state.get("graded_ids") or []
+    seen = set(graded)
+    new_ids = [cid for cid in chunk_ids if cid not in seen]
+    chunks = await chunk_store.get_many(runtime.context.user_id, new_ids)
+    scores = {ref["id"]: ref["score"] for ref in refs}
+    relevant = await _gate_and_grade(question, chunks, scores) if chunks else []
+    return {"documents": relevant, "graded_ids": graded + new_ids}
 
-    score = response.binary_score
-
-    if score == "yes":
+def route_after_grading(state: RAGState) -> Literal["generate_answer", "rewrite_question", "fanout_retrieve"]:
+    """Answer if any chunk survived grading (or retries are exhausted), otherwise rewrite."""
+    if state.get("documents") or state.get("loop_step", 0) >= MAX_RETRIES:
         return "generate_answer"
-    else:
-        return "rewrite_question"
+    if settings.REWRITE_MODE == "fanout":
+        return "fanout_retrieve"
+    return "rewrite_question"
+
+@observe_node
+async def fanout_retrieve(state: RAGState, runtime: Runtime[UserContext]):
+    """
+    One-round alternative to the rewrite loop: generate the rewrite, keywords and
+    entities/dates variants in a single call, search them concurrently, fuse the
+    rankings (RRF) and grade the result once.
+    """
+    last_human_msg = [m for m in state["messages"] if m.type == "human"][-1]
+    question = last_human_msg.content
+
+    variants = await query_variants_model.ainvoke(
+        [{"role": "user", "content": FANOUT_QUERIES_PROMPT.format(question=question)}],
+        config={"tags": ["internal_rewrite"]}
+    )
+    # Skip empty or repeated variants
+    queries = list(dict.fromkeys(q.strip() for q in (variants.rewrite, variants.keywords, variants.entities) if q.strip()))
+    print(f"--- FAN-OUT RETRIEVAL: {queries} ---")
+
+    results = await asyncio.gather(
+        *(asyncio.to_thread(search_documents, runtime.context.user_id, q) for q in queries),
+        return_exceptions=True
+    )
+    rankings = []
+    for query, result in zip(queries, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ Fan-out search failed for '{query}': {result}")
+        else:
+            rankings.append(result)
 
+    fused = reciprocal_rank_fusion(rankings, k=settings.RRF_K, top_k=settings.FANOUT_TOP_K)
+    graded = set(state.get("graded_ids") or [])
+    chunks = {chunk_id(doc): doc.page_content for doc in fused if doc.page_content.strip()}
+    chunks = {cid: text for cid, text in chunks.items() if cid not in graded}
+    scores = {chunk_id(doc): doc.metadata.get("score") or 0.0 for doc in fused}
+
+    # No further loops: generate_answer works with whatever survives
+    relevant = await _gate_and_grade(question, chunks, scores) if chunks else []
+    return {"documents": relevant, "loop_step": MAX_RETRIES}
+
+@observe_node
 async def rewrite_question(state: RAGState):
     """Rewrite the question based on the loop count."""
     
@@ -93,39 +275,109 @@ async def rewrite_question(state: RAGState):
     else:
         instructions = f"The previous searches failed. Focus ONLY on the dates or proper nouns in this question: {original_question}"
 
-    response = await response_model.ainvoke([{"role": "user", "content": instructions}])
+    response = await rewrite_model.ainvoke(
+        [{"role": "user", "content": instructions}],
+        config={"tags": ["internal_rewrite"]}
+    )
     
     return {
         "rewritten_question": response.content,
         "loop_step": loop_step + 1
     }
 
-async def generate_answer(state: RAGState):
-    """Generate an answer."""
-    
-    # 1. Extract context (Optional: You can keep this to reinforce context in the system prompt)
-    all_tool_msgs = [m for m in state["messages"] if isinstance(m, ToolMessage)]
-    context = ""
-    if all_tool_msgs:
-        context = all_tool_msgs[-1].content
-    else:
-        context = "No context available."
+def _history_turns(messages: list) -> list:
+    """Finished conversation turns: user messages and final answers (tool traffic is left out)."""
+    return [
+        m for m in messages
+        if isinstance(m, HumanMessage) or (isinstance(m, AIMessage) and not m.tool_calls)
+    ]
 
-    # 2. Setup System Prompt
-    system_prompt_content = f"""{ANSWER_INSTURCTION}
+def _turn_line(message) -> str:
+    return f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.text}"
 
-    background_context:
-    {context}
-    """
-    
-    messages_to_send = [SystemMessage(content=system_prompt_content)]
+def _turns_excerpt(turns: list, max_tokens: int) -> str:
+    """The most recent of `turns` as transcript lines, the oldest one shown cut to fit `max_tokens`."""
+    lines = []
+    for message in reversed(turns):
+        line = truncate_tokens(_turn_line(message), max_tokens)
+        if not line:
+            break
+        lines.insert(0, line)
+        max_tokens -= count_tokens(line)
+    return "\n".join(lines)
 
-    # 3. Add History
-    for msg in state["messages"]:
-        if isinstance(msg, (HumanMessage, AIMessage, ToolMessage)): 
-            messages_to_send.append(msg)
+async def _summarize_turns(summary: str, turns: list) -> str:
+    """Fold `turns` into the running summary."""
+    lines = "\n".join(_turn_line(m) for m in turns)
+    prompt = SUMMARIZE_HISTORY_PROMPT.format(summary=summary or "(empty)", turns=lines)
+    response = await summary_model.ainvoke(
+        [{"role": "user", "content": prompt}],
+        config={"tags": ["internal_summary"]}
+    )
+    return response.text.strip()
 
-    # 4. Generate Response
-    response = await response_model.ainvoke(messages_to_send)
+@observe_node
+async def generate_answer(state: RAGState, runtime: Runtime[UserContext]):
+    """Generate an answer from a token-budgeted context."""
+
+    # 1. Split history into the current question and the earlier turns
+    history = _history_turns(state["messages"])
+    last_human = max(i for i, m in enumerate(history) if isinstance(m, HumanMessage))
+    question_msg = history[last_human]
+    summary = state.get("summary", "")
+    summarized = state.get("summarized_turns", 0)
+    # Turns already folded into the summary are never sent raw again
+    turns = history[summarized:last_human]
+
+    # 2. Fixed part: instructions, question and room for the summary
+    # Rehydrate the graded chunk ids (in rank order) from the chunk store
+    document_ids = state.get("documents") or []
+    texts = await chunk_store.get_many(runtime.context.user_id, document_ids)
+    documents = [texts[cid] for cid in document_ids if cid in texts]
+    reserved = settings.CONTEXT_SUMMARY_MAX_TOKENS if settings.CONTEXT_SUMMARIZE else count_tokens(summary)
+    fixed = (
+        count_tokens(ANSWER_INSTURCTION)
+        + count_tokens(question_msg.text)
+        + message_tokens(question_msg)
+        + reserved
+        + MESSAGE_OVERHEAD_TOKENS
+    )
+    packed = pack_context(fixed, documents, turns, settings.CONTEXT_TOKEN_BUDGET)
+    dropped = turns[:packed.first_turn]
+    if packed.dropped_chunks or dropped:
+        print(f"--- CONTEXT PACKED: {len(packed.chunks)}/{len(documents)} chunks, "
+              f"{len(turns) - len(dropped)}/{len(turns)} turns, ~{packed.tokens} tokens ---")
+
+    # 3. System prompt: the chunks go in once, inside the instruction template
+    context = CHUNK_SEPARATOR.join(packed.chunks) if packed.chunks else "No context available."
+    system_prompt_content = ANSWER_INSTURCTION.format(context=context, question=question_msg.text)
+    if summary:
+        system_prompt_content += f"\nCONVERSATION SUMMARY (earlier turns):\n{summary}\n"
+    # Dropped turns reach the summary in batches (and only for the next request), so until
+    # then an excerpt of them fills the summary room the summary doesn't use yet
+    if settings.CONTEXT_SUMMARIZE and dropped:
+        excerpt = _turns_excerpt(dropped, reserved - count_tokens(summary))
+        if excerpt:
+            system_prompt_content += f"\nEARLIER TURNS (not yet summarized, may be cut):\n{excerpt}\n"
+
+    messages_to_send = [SystemMessage(content=system_prompt_content), *turns[packed.first_turn:], question_msg]
+
+    # 4. Generate the response. Dropped turns are summarized alongside it (for the next
+    # request), in batches so the summary isn't rewritten on every turn.
+    updates = {}
+    if settings.CONTEXT_SUMMARIZE and len(dropped) >= settings.CONTEXT_SUMMARY_BATCH_TURNS:
+        response, new_summary = await asyncio.gather(
+            response_model.ainvoke(messages_to_send),
+            _summarize_turns(summary, dropped),
+            return_exceptions=True
+        )
+        if isinstance(response, BaseException):
+            raise response
+        if isinstance(new_summary, BaseException):
+            print(f"⚠️ History summary failed, keeping the previous one: {new_summary}")
+        else:
+            updates = {"summary": new_summary, "summarized_turns": summarized + len(dropped)}
+    else:
+        response = await response_model.ainvoke(messages_to_send)
 
-    return {"messages": [response], "loop_step": 0}
\ No newline at end of file
+    return {"messages": [response], "loop_step": 0, "documents": [], "graded_ids": [], **updates}
@@ -0,0 +1,149 @@
+"""
+Cheap relevance gate in front of the LLM grader.
+
+Each retrieved chunk gets a combined score from its hybrid search score, the share of
+the question's entities (names, numbers, dates) found in it and, optionally, a
+FlashRank cross-encoder score. Chunks above RELEVANCE_ACCEPT_THRESHOLD are kept and
+chunks below RELEVANCE_REJECT_THRESHOLD dropped without an LLM call; only the band in
+between goes to the grader. Decisions can be logged to JSONL (RELEVANCE_LOG_PATH, off
+by default) to calibrate the thresholds offline against the grader's labels
+(RELEVANCE_GATE=shadow grades everything). The log contains user questions.
+"""
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.vector_store import get_vector_store_service
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "could", "did", "do", "does", "for",
+    "from", "give", "has", "have", "how", "i", "in", "is", "it", "list", "me", "of", "on", "or",
+    "please", "show", "tell", "that", "the", "their", "there", "this", "to", "was", "were",
+    "what", "when", "where", "which", "who", "whom", "why", "with", "would", "you", "your",
+}
+
+
+@dataclass
+class GateDecision:
+    accepted: list[str] = field(default_factory=list)
+    rejected: list[str] = field(default_factory=list)
+    uncertain: list[str] = field(default_factory=list)
+    features: dict[str, dict] = field(default_factory=dict)  # chunk id -> scores
+
+
+def _is_entity(token: str, sentence_start: bool) -> bool:
+    if token.lower() in STOPWORDS:
+        return False
+    if token[0].isdigit() or (len(token) > 1 and token.isupper()):
+        return True
+    # A capital at the start of a sentence ("Explain ...", "Summarize ...") says nothing
+    return token[0].isupper() and not sentence_start
+
+
+def question_entities(question: str) -> set[str]:
+    """Numbers / dates, acronyms and capitalised terms; the content words if there are none."""
+    tokens, entities = [], set()
+    for sentence in re.split(r"(?<=[.!?])\s+", question.strip()):
+        words = re.findall(r"\d[\d,./-]*\d|\d|[A-Za-z][\w&'-]*", sentence)
+        tokens += words
+        entities |= {t.lower() for i, t in enumerate(words) if _is_entity(t, i == 0)}
+    if not entities:
+        entities = {t.lower() for t in tokens if len(t) > 3 and t.lower() not in STOPWORDS}
+    return entities
+
+
+def entity_overlap(entities: set[str], text: str) -> float:
+    if not entities:
+        return 0.0
+    lowered = text.lower()
+    return sum(1 for entity in entities if entity in lowered) / len(entities)
+
+
+@lru_cache()
+def get_reranker():
+    """FlashRank cross-encoder, loaded once (None if it can't be loaded)."""
+    try:
+        from flashrank import Ranker
+        return Ranker(model_name=settings.RELEVANCE_RERANK_MODEL, cache_dir=settings.RELEVANCE_RERANK_CACHE_DIR)
+    except Exception as e:
+        print(f"⚠️ Reranker '{settings.RELEVANCE_RERANK_MODEL}' unavailable, gating without it: {e}")
+        return None
+
+
+def rerank_scores(question: str, chunks: dict[str, str]) -> dict[str, float] | None:
+    ranker = get_reranker()
+    if ranker is None:
+        return None
+    from flashrank import RerankRequest
+    passages = [{"id": chunk_id, "text": text} for chunk_id, text in chunks.items()]
+    return {row["id"]: float(row["score"]) for row in ranker.rerank(RerankRequest(query=question, passages=passages))}
+
+
+def relevance_gate(question: str, chunks: dict[str, str], scores: dict[str, float]) -> GateDecision:
+    """Split chunks into accepted / rejected / uncertain (blocking when the reranker is on)."""
+    entities = question_entities(question)
+    max_score = get_vector_store_service().max_score
+    reranked = rerank_scores(question, chunks) if settings.RELEVANCE_RERANK else None
+
+    weights = {"search": settings.RELEVANCE_SEARCH_WEIGHT, "overlap": settings.RELEVANCE_OVERLAP_WEIGHT}
+    if reranked is not None:
+        weights["rerank"] = settings.RELEVANCE_RERANK_WEIGHT
+    total_weight = sum(weights.values()) or 1.0
+
+    decision = GateDecision()
+    for chunk_id, text in chunks.items():
+        features = {
+            "search": min((scores.get(chunk_id) or 0.0) / max_score, 1.0),
+            "overlap": entity_overlap(entities, text),
+        }
+        if reranked is not None:
+            features["rerank"] = reranked.get(chunk_id, 0.0)
+        features["combined"] = sum(weights[name] * features[name] for name in weights) / total_weight
+        decision.features[chunk_id] = features
+
+        if features["combined"] >= settings.RELEVANCE_ACCEPT_THRESHOLD:
+            decision.accepted.append(chunk_id)
+        elif features["combined"] <= settings.RELEVANCE_REJECT_THRESHOLD:
+            decision.rejected.append(chunk_id)
+        else:
+            decision.uncertain.append(chunk_id)
+    return decision
+
+
+def log_gate_decisions(question: str, decision: GateDecision, graded: list[str], relevant: list[str]):
+    """
+    Append one JSONL row per chunk: the gate's features and decision, plus the LLM
+    grader's label for the chunks it saw (label_scope says whether that label was per
+    chunk or one yes/no for the whole graded context).
+    """
+    if not settings.RELEVANCE_LOG_PATH or random.random() >= settings.RELEVANCE_LOG_SAMPLE_RATE:
+        return
+    graded, relevant = set(graded), set(relevant)
+    gate_labels = {
+        **{cid: "accept" for cid in decision.accepted},
+        **{cid: "reject" for cid in decision.rejected},
+        **{cid: "uncertain" for cid in decision.uncertain},
+    }
+    now = time.time()
+    rows = [
+        json.dumps({
+            "ts": now,
+            "mode": settings.RELEVANCE_GATE,
+            "question": question,
+            "chunk_id": chunk_id,
+            **{name: round(value, 4) for name, value in features.items()},
+            "gate": gate_labels[chunk_id],
+            "llm": (chunk_id in relevant) if chunk_id in graded else None,
+            "label_scope": settings.GRADER_MODE,
+        })
+        for chunk_id, features in decision.features.items()
+    ]
+    path = Path(settings.RELEVANCE_LOG_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as log:
+        log.write("\n".join(rows) + "\n")
@@ -1,30 +1,105 @@
+import re
+import json
+import hashlib
 from langchain.tools import tool, ToolRuntime
+from langchain_core.documents import Document
+from app.core.metrics import VECTOR_STORE_SECONDS
 from app.services.vector_store import get_vector_store_service
-from dataclasses import dataclass
+from app.services.graph.chunk_store import chunk_store
+from app.services.singleflight import search_flight, flight_key
+from dataclasses import dataclass, field
+
+# Separates chunks in the prompt context
+CHUNK_SEPARATOR = "\n\n---\n\n"
 
 @dataclass
 class UserContext:
     user_id: str
+    # Per-request results of speculative retrieval, keyed by the query they were fetched for
+    prefetched: dict[str, list[Document]] = field(default_factory=dict)
+
+
+def chunk_id(doc: Document) -> str:
+    """Stable chunk identity: the Milvus pk (content hash if the document has none)."""
+    pk = doc.metadata.get("pk")
+    if pk is not None:
+        return str(pk)
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:16]
+
+
+def _search(user_id: str, query: str) -> list[Document]:
+    docs = []
+    with VECTOR_STORE_SECONDS.labels(op="search").time():
+        results = get_vector_store_service().search_with_scores(user_id, query)
+    for doc, score in results:
+        doc.metadata["score"] = score
+        docs.append(doc)
+    return docs
+
+
+def search_documents(user_id: str, query: str) -> list[Document]:
+    """
+    Hybrid search over the user's documents (blocking).
+    The fused score is kept in metadata["score"] and the texts go to the chunk store.
+    Identical concurrent searches (double submits, speculative + tool search) share one call.
+    """
+    docs = search_flight.do(flight_key(user_id, query), lambda: _search(user_id, query))
+    chunk_store.put_documents(user_id, [chunk_id(doc) for doc in docs], docs)
+    return docs
+
+
+def parse_chunk_refs(tool_output: str) -> list[dict]:
+    """[{"id", "score"}, ...] from a retrieval tool message (empty if it isn't one)."""
+    try:
+        return json.loads(tool_output).get("chunks", [])
+    except (ValueError, AttributeError):
+        return []
+
+
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the lowercase word sets of two queries."""
+    tokens_a = set(re.findall(r"\w+", a.lower()))
+    tokens_b = set(re.findall(r"\w+", b.lower()))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int = 60, top_k: int | None = None) -> list[Document]:
+    """
+    Merge several ranked result lists: every document scores sum(1 / (k + rank)) over the
+    lists it appears in. Documents are identified by chunk_id().
+    """
+    scores: dict[str, float] = {}
+    docs: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = chunk_id(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:top_k]]
 
 
 @tool
 def get_retrievel_tool(query: str, runtime: ToolRuntime[UserContext]) -> str:
     """
-    Search and return information about the uploaded documents.
+    Search the uploaded documents. Returns references (ids and scores) to the matching chunks.
     This tool automatically filters by the current user's ID.
     """
     # Access user_id from runtime context
     user_id = runtime.context.user_id
-    service = get_vector_store_service()
-    
-    print(f"🔍 Tool Execution: Searching docs for User {user_id}...")
-    
-    retriever = service.get_retreiver(user_id)
-    docs = retriever.invoke(query)
-    
-    if not docs:
-        return "No relevant documents found."
-    
-    formatted_docs = "\n\n---\n\n".join([doc.page_content for doc in docs])
-    return formatted_docs
 
+    # Reuse a speculative retrieval started alongside the router call
+    docs = runtime.context.prefetched.pop(query, None)
+    if docs is not None:
+        print(f"⚡ Tool Execution: Using prefetched docs for User {user_id}")
+    else:
+        print(f"🔍 Tool Execution: Searching docs for User {user_id}...")
+        docs = search_documents(user_id, query)
+    
+    # Only references go into the message (and so into every checkpoint after it);
+    # the texts are rehydrated from the chunk store when a prompt is built
+    refs = [{"id": chunk_id(doc), "score": round(float(doc.metadata.get("score") or 0.0), 6)} for doc in docs]
+    return json.dumps({"chunks": refs})
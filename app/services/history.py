@@ -1,32 +1,163 @@
 from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
+from psycopg.types.json import Json
+from langchain_core.messages import BaseMessage, HumanMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
 
 
 async def upsert_thread(pool: AsyncConnectionPool, thread_id: str, user_id: str, title: str):
 
+    # New threads log their messages to thread_messages from the start
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
-                INSERT INTO threads (thread_id, user_id, title, updated_at)
-                VALUES (%s, %s, %s, NOW())
+                INSERT INTO threads (thread_id, user_id, title, updated_at, messages_indexed)
+                VALUES (%s, %s, %s, NOW(), TRUE)
                 ON CONFLICT (thread_id) 
                 DO UPDATE SET updated_at = NOW()
             """, (thread_id, user_id, title))
 
 
-async def get_user_threads(pool: AsyncConnectionPool, user_id: str):
+async def get_user_threads(pool: AsyncConnectionPool, user_id: str, limit: int, after: tuple = None):
     """
-    Fetches chats using the passed pool.
+    Fetches one page of chats using the passed pool, most recently updated first.
+    `after` is the (updated_at, thread_id) of the last row of the previous page.
+    Served by idx_threads_user_updated.
     """
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("""
-                SELECT thread_id, title, created_at 
-                FROM threads 
-                WHERE user_id = %s 
-                ORDER BY updated_at DESC
-            """, (user_id,))
+            if after:
+                await cur.execute("""
+                    SELECT thread_id, title, created_at, updated_at
+                    FROM threads 
+                    WHERE user_id = %s AND (updated_at, thread_id) < (%s, %s)
+                    ORDER BY updated_at DESC, thread_id DESC
+                    LIMIT %s
+                """, (user_id, *after, limit))
+            else:
+                await cur.execute("""
+                    SELECT thread_id, title, created_at, updated_at
+                    FROM threads 
+                    WHERE user_id = %s 
+                    ORDER BY updated_at DESC, thread_id DESC
+                    LIMIT %s
+                """, (user_id, limit))
             
             results = await cur.fetchall()
             return results
-        
+
+
+# --- Thread messages (display copy of the conversation, paged without touching checkpoints) ---
+
+def display_message(msg: BaseMessage) -> dict | None:
+    """Frontend shape of a message; None for messages that are never shown (tool outputs)."""
+    if msg.type == "tool":
+        return None
+    return {
+        "role": "user" if isinstance(msg, HumanMessage) else "bot",
+        "content": msg.text,
+        "type": "human" if isinstance(msg, HumanMessage) else "ai",
+        "tool_calls": getattr(msg, "tool_calls", None) or None,
+    }
+
+
+async def append_thread_messages(pool: AsyncConnectionPool, thread_id: str, messages: list[BaseMessage]):
+    rows = [m for m in map(display_message, messages) if m]
+    if not rows:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany("""
+                INSERT INTO thread_messages (thread_id, role, type, content, tool_calls)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [
+                (thread_id, m["role"], m["type"], m["content"], Json(m["tool_calls"]) if m["tool_calls"] else None)
+                for m in rows
+            ])
+
+
+async def get_thread(pool: AsyncConnectionPool, thread_id: str):
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                SELECT thread_id, user_id, messages_indexed FROM threads WHERE thread_id = %s
+            """, (thread_id,))
+            return await cur.fetchone()
+
+
+async def get_thread_messages(pool: AsyncConnectionPool, thread_id: str, limit: int, before: tuple = None):
+    """
+    One page of a thread's messages, newest first.
+    `before` is the (created_at, id) of the oldest message of the previous page.
+    Served by idx_thread_messages_thread_created, so the cost doesn't grow with the thread.
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            if before:
+                await cur.execute("""
+                    SELECT id, role, type, content, tool_calls, created_at
+                    FROM thread_messages
+                    WHERE thread_id = %s AND (created_at, id) < (%s, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (thread_id, *before, limit))
+            else:
+                await cur.execute("""
+                    SELECT id, role, type, content, tool_calls, created_at
+                    FROM thread_messages
+                    WHERE thread_id = %s
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (thread_id, limit))
+            return await cur.fetchall()
+
+
+# Only the blob of the `messages` channel at the latest checkpoint (no other channels, no writes)
+LATEST_MESSAGES_BLOB = """
+    SELECT b.type, b.blob
+    FROM checkpoints c
+    JOIN checkpoint_blobs b
+      ON b.thread_id = c.thread_id
+     AND b.checkpoint_ns = c.checkpoint_ns
+     AND b.channel = 'messages'
+     AND b.version = c.checkpoint -> 'channel_versions' ->> 'messages'
+    WHERE c.thread_id = %s AND c.checkpoint_ns = ''
+    ORDER BY c.checkpoint_id DESC
+    LIMIT 1
+"""
+
+
+async def index_thread_messages(pool: AsyncConnectionPool, serde: SerializerProtocol, thread_id: str):
+    """
+    One-off backfill of thread_messages for threads created before it existed,
+    from the messages channel of the latest checkpoint.
+    """
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                # Lock the thread row so concurrent first opens backfill once
+                await cur.execute("""
+                    SELECT messages_indexed FROM threads WHERE thread_id = %s FOR UPDATE
+                """, (thread_id,))
+                row = await cur.fetchone()
+                if row is None or row[0]:
+                    return
+
+                await cur.execute(LATEST_MESSAGES_BLOB, (thread_id,))
+                blob = await cur.fetchone()
+                messages = serde.loads_typed((blob[0], bytes(blob[1]))) if blob and blob[1] else []
+                rows = [m for m in map(display_message, messages) if m]
+
+                # Rows logged since the upgrade are also in the checkpoint: rebuild from scratch
+                await cur.execute("DELETE FROM thread_messages WHERE thread_id = %s", (thread_id,))
+                await cur.executemany("""
+                    INSERT INTO thread_messages (thread_id, role, type, content, tool_calls)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, [
+                    (thread_id, m["role"], m["type"], m["content"], Json(m["tool_calls"]) if m["tool_calls"] else None)
+                    for m in rows
+                ])
+                await cur.execute("""
+                    UPDATE threads SET messages_indexed = TRUE WHERE thread_id = %s
+                """, (thread_id,))
+                print(f"🗂️ Indexed {len(rows)} messages for thread {thread_id}")
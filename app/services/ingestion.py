@@ -8,6 +8,8 @@ from functools import lru_cache
 # REMOVED: chunking libraries
 
 from app.core.config import settings
+from app.core.metrics import INGESTION_STAGE_SECONDS
+from app.services.text_layer import scan_document
 from app.services.vector_store import get_vector_store_service, VectorStoreService
 
 class IngestionService:
@@ -56,6 +58,27 @@ class IngestionService:
             
         return destination_path
     
+    def prescan_documents(self, destination_paths: list[Path]) -> dict:
+        """
+        Classify every page as text / scanned / mixed before conversion.
+        Returns {filename: scan} where scan["ocr_pages"] is the OCR plan for Docling.
+        """
+        scans = {}
+        for path in destination_paths:
+            path = Path(path)
+            try:
+                with INGESTION_STAGE_SECONDS.labels(stage="prescan").time():
+                    scans[path.name] = scan_document(path)
+            except Exception as e:
+                # Unreadable text layer -> fall back to OCR on the whole document
+                print(f"⚠️ Pre-scan failed for {path.name}, OCR will run on all pages: {e}")
+                scans[path.name] = {"pages": None, "needs_ocr": True, "ocr_pages": None, "error": str(e)}
+
+        total_pages = sum(s["pages"] or 0 for s in scans.values())
+        ocr_pages = sum(len(s["ocr_pages"] or []) for s in scans.values())
+        print(f"🔎 Pre-scan: {total_pages} pages, {ocr_pages} need OCR")
+        return scans
+
     # --- MOCKED METHODS BELOW ---
     
     def docling_conversions(self, destination_paths: list[Path]):
@@ -0,0 +1,170 @@
+import threading
+from dataclasses import dataclass
+
+import httpx
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from app.core.config import settings
+from app.core.metrics import llm_metrics_handler, TimedEmbeddings
+from app.services.singleflight import SingleFlightChatMixin, SingleFlightEmbeddings
+
+
+@dataclass
+class ClientStats:
+    requests: int = 0
+    connections_opened: int = 0  # new TCP connections; every other request reused a pooled one
+
+    def as_dict(self) -> dict:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else None,
+        }
+
+
+class HttpClientPool:
+    """
+    One shared sync and one shared async httpx client per upstream base URL, so every
+    chat model / embedding instance talking to the same provider reuses the same
+    keep-alive connections. Their connections are closed in the app lifespan.
+    """
+    def __init__(self):
+        self._sync: dict[str, httpx.Client] = {}
+        self._async: dict[str, httpx.AsyncClient] = {}
+        # Kept so shutdown can close the connections without closing the clients
+        self._sync_transports: dict[str, httpx.HTTPTransport] = {}
+        self._async_transports: dict[str, httpx.AsyncHTTPTransport] = {}
+        self._stats: dict[str, ClientStats] = {}
+        self._lock = threading.Lock()
+
+    def _options(self, base_url: str) -> dict:
+        stats = self._stats.setdefault(base_url, ClientStats())
+
+        # httpcore trace extension: connect_tcp fires once per newly opened connection
+        def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.complete":
+                stats.connections_opened += 1
+
+        async def trace_async(event: str, info: dict):
+            trace(event, info)
+
+        def on_request(request: httpx.Request):
+            stats.requests += 1
+            request.extensions["trace"] = trace
+
+        async def on_request_async(request: httpx.Request):
+            stats.requests += 1
+            request.extensions["trace"] = trace_async
+
+        http2 = settings.LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("⚠️ LLM_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+
+        return {
+            "http2": http2,
+            "timeout": httpx.Timeout(settings.LLM_HTTP_TIMEOUT_SECONDS, connect=settings.LLM_HTTP_CONNECT_TIMEOUT_SECONDS),
+            "limits": httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_SECONDS,
+            ),
+            "hooks": (on_request, on_request_async),
+        }
+
+    def sync_client(self, base_url: str) -> httpx.Client:
+        with self._lock:
+            if base_url not in self._sync:
+                options = self._options(base_url)
+                # Transport-level retries only cover failed connects; the OpenAI SDK
+                # retries 429/5xx responses (LLM_MAX_RETRIES)
+                transport = self._sync_transports[base_url] = httpx.HTTPTransport(
+                    http2=options["http2"], limits=options["limits"], retries=settings.LLM_HTTP_CONNECT_RETRIES
+                )
+                self._sync[base_url] = httpx.Client(
+                    timeout=options["timeout"],
+                    transport=transport,
+                    event_hooks={"request": [options["hooks"][0]]},
+                )
+            return self._sync[base_url]
+
+    def async_client(self, base_url: str) -> httpx.AsyncClient:
+        with self._lock:
+            if base_url not in self._async:
+                options = self._options(base_url)
+                transport = self._async_transports[base_url] = httpx.AsyncHTTPTransport(
+                    http2=options["http2"], limits=options["limits"], retries=settings.LLM_HTTP_CONNECT_RETRIES
+                )
+                self._async[base_url] = httpx.AsyncClient(
+                    timeout=options["timeout"],
+                    transport=transport,
+                    event_hooks={"request": [options["hooks"][1]]},
+                )
+            return self._async[base_url]
+
+    def stats(self) -> dict:
+        return {base_url: stats.as_dict() for base_url, stats in self._stats.items()}
+
+    async def aclose(self):
+        """
+        Close the pooled connections. The clients themselves stay usable: the module-level
+        models (app/services/graph/nodes.py) hold them for the life of the process, so a
+        later lifespan in the same process (tests, in-process load tests) opens new connections.
+        """
+        for transport in self._async_transports.values():
+            await transport.aclose()
+        for transport in self._sync_transports.values():
+            transport.close()
+
+
+http_clients = HttpClientPool()
+
+
+class SingleFlightChatOpenAI(SingleFlightChatMixin, ChatOpenAI):
+    """ChatOpenAI whose identical concurrent calls share one request."""
+
+
+def chat_model(**kwargs) -> BaseChatModel:
+    """ChatOpenAI on OpenRouter using the shared HTTP clients (or the fake model, see LLM_PROVIDER)."""
+    if settings.METRICS_ENABLED:
+        kwargs.setdefault("callbacks", [llm_metrics_handler])
+    # Deterministic calls give the same answer to everyone, so concurrent duplicates can share one
+    deduplicate = kwargs.get("temperature") == 0
+    if settings.LLM_PROVIDER == "fake":
+        from app.services.fakes import FakeChatModel, SingleFlightFakeChatModel
+        return (SingleFlightFakeChatModel if deduplicate else FakeChatModel)(**kwargs)
+    base_url = settings.OPEN_ROUTER_BASE_URL
+    kwargs.setdefault("model", settings.OPEN_ROUTER_CHAT_LLM)
+    # Streamed calls only report token usage when asked to
+    kwargs.setdefault("stream_usage", True)
+    return (SingleFlightChatOpenAI if deduplicate else ChatOpenAI)(
+        base_url=base_url,
+        api_key=settings.OPEN_ROUTER_API,
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=http_clients.sync_client(base_url),
+        http_async_client=http_clients.async_client(base_url),
+        **kwargs
+    )
+
+
+def embedding_model() -> Embeddings:
+    """OpenAIEmbeddings on OpenRouter using the shared HTTP clients (or the fake embedder, see LLM_PROVIDER)."""
+    if settings.LLM_PROVIDER == "fake":
+        from app.services.fakes import fake_embedding_model
+        return SingleFlightEmbeddings(TimedEmbeddings(fake_embedding_model()), "fake")
+    base_url = settings.OPEN_ROUTER_BASE_URL
+    return SingleFlightEmbeddings(TimedEmbeddings(OpenAIEmbeddings(
+        base_url=base_url,
+        api_key=settings.OPEN_ROUTER_API,
+        model=settings.OPEN_ROUTER_EMBEDDING_MODEL,
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=http_clients.sync_client(base_url),
+        http_async_client=http_clients.async_client(base_url),
+    )), settings.OPEN_ROUTER_EMBEDDING_MODEL)
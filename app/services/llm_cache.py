@@ -0,0 +1,148 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+from app.core.config import settings
+from app.core.redis import RedisBackoff, get_redis, get_async_redis
+
+KEY_PREFIX = "llm_cache:"
+
+
+@dataclass
+class LLMCacheStats:
+    lookups: int = 0
+    memory_hits: int = 0
+    redis_hits: int = 0
+
+    def as_dict(self) -> dict:
+        hits = self.memory_hits + self.redis_hits
+        return {
+            "lookups": self.lookups,
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+        }
+
+
+class TieredLLMCache(BaseCache):
+    """
+    Exact-match cache for deterministic LLM calls (graders, rewrites), keyed by
+    (model + params, normalized messages). An in-process LRU sits in front of Redis,
+    which shares entries between API processes. Redis errors only disable that tier
+    for a short while; they never fail the LLM call.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, RETURN_VAL_TYPE] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = RedisBackoff("LLM cache", "using memory only")
+        self.stats = LLMCacheStats()
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        # llm_string already holds the model, params and bound tools / schemas
+        normalized = " ".join(prompt.split())
+        digest = hashlib.sha256(f"{llm_string}\x00{normalized}".encode("utf-8")).hexdigest()
+        return KEY_PREFIX + digest
+
+    # --- memory tier ---
+
+    def _get_local(self, key: str) -> RETURN_VAL_TYPE | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+        # LangChain stamps ids on the returned messages, so hand out copies
+        return [generation.model_copy(deep=True) for generation in value]
+
+    def _put_local(self, key: str, value: RETURN_VAL_TYPE):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- redis tier ---
+
+    def _redis_enabled(self) -> bool:
+        return settings.LLM_CACHE_REDIS and self._redis.available
+
+    def _from_redis(self, key: str, raw) -> RETURN_VAL_TYPE | None:
+        if raw is None:
+            return None
+        value = loads(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+        self._put_local(key, value)
+        self.stats.redis_hits += 1
+        return [generation.model_copy(deep=True) for generation in value]
+
+    # --- BaseCache ---
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        key = self.key(prompt, llm_string)
+        self.stats.lookups += 1
+        if (value := self._get_local(key)) is not None:
+            self.stats.memory_hits += 1
+            return value
+        if self._redis_enabled():
+            try:
+                return self._from_redis(key, get_redis().get(key))
+            except Exception as e:
+                self._redis.failed(e)
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        self._put_local(key, return_val)
+        if self._redis_enabled():
+            try:
+                get_redis().set(key, dumps(return_val), ex=self.ttl_seconds)
+            except Exception as e:
+                self._redis.failed(e)
+
+    async def alookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        key = self.key(prompt, llm_string)
+        self.stats.lookups += 1
+        if (value := self._get_local(key)) is not None:
+            self.stats.memory_hits += 1
+            return value
+        if self._redis_enabled():
+            try:
+                return self._from_redis(key, await get_async_redis().get(key))
+            except Exception as e:
+                self._redis.failed(e)
+        return None
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        self._put_local(key, return_val)
+        if self._redis_enabled():
+            try:
+                await get_async_redis().set(key, dumps(return_val), ex=self.ttl_seconds)
+            except Exception as e:
+                self._redis.failed(e)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._redis_enabled():
+            try:
+                client = get_redis()
+                for key in client.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+                    client.delete(key)
+            except Exception as e:
+                self._redis.failed(e)
+
+
+llm_cache = TieredLLMCache(settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL_SECONDS)
+
+
+def cache_for(call_site: str) -> BaseCache | bool:
+    """The shared cache if LLM_CACHE_NODES enables this call site, else False (no caching)."""
+    return llm_cache if call_site in settings.LLM_CACHE_NODES else False
@@ -0,0 +1,337 @@
+"""
+Single-flight deduplication: identical concurrent calls share one upstream call.
+
+In-process, the first caller for a key (the leader) runs the call and everyone who
+asks for the same key meanwhile waits on its future; this works from threads
+(searches, embeddings) and coroutines (LLM calls) alike. With SINGLEFLIGHT_REDIS the
+leader also takes a short Redis lock, so leaders in other processes wait for it and
+reuse its result (kept for SINGLEFLIGHT_RESULT_TTL_SECONDS) instead of calling again.
+Nothing is cached beyond that: a call that starts after the leader finished runs again.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import ChatResult
+from langchain_core.utils.utils import LC_ID_PREFIX
+
+from app.core.config import settings
+from app.core.redis import RedisBackoff, get_redis, get_async_redis
+
+KEY_PREFIX = "singleflight:"
+
+# Delete the lock only if we still hold it (it may have expired and been taken over)
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class LeaderCancelled(Exception):
+    """The leader was cancelled before finishing; its followers retry."""
+
+
+@dataclass
+class SingleFlightStats:
+    leaders: int = 0  # first caller for a key in this process (ran it, or reused a remote result)
+    shared: int = 0  # calls that waited for a leader in this process
+    remote_shared: int = 0  # leaders that reused the result of another process instead
+
+    def as_dict(self) -> dict:
+        total = self.leaders + self.shared
+        return {
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "remote_shared": self.remote_shared,
+            "dedup_rate": round((self.shared + self.remote_shared) / total, 4) if total else 0.0,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.future = Future()
+        self.followers = 0
+
+
+def flight_key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    One kind of deduplicated work. `dump` / `load` (de)serialize results for Redis;
+    without them the flight is in-process only. `share` makes the copy a follower gets.
+    """
+    def __init__(self, name: str, dump: Callable[[Any], str] | None = None, load: Callable[[str], Any] | None = None,
+                 share: Callable[[Any], Any] = copy.deepcopy):
+        self.name = name
+        self.dump = dump
+        self.load = load
+        self.share = share
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._redis = RedisBackoff(f"Single-flight '{name}'", "deduplicating in-process only")
+        self.stats = SingleFlightStats()
+
+    def _join(self, key: str) -> tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.stats.shared += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.stats.leaders += 1
+            return call, True
+
+    def _finish(self, key: str, call: _Call, result: Any = None, error: BaseException | None = None) -> Any:
+        # Followers only join while the call is registered, so the count is final here
+        with self._lock:
+            self._calls.pop(key, None)
+            followers = call.followers
+        if error is not None:
+            call.future.set_exception(error)
+            return None
+        call.future.set_result(result)
+        # The future keeps the original for the followers to copy; nobody gets the same objects
+        return copy.deepcopy(result) if followers else result
+
+    # --- Redis ---
+
+    def _remote(self) -> bool:
+        return self.load is not None and settings.SINGLEFLIGHT_REDIS and self._redis.available
+
+    def _keys(self, key: str) -> tuple[str, str]:
+        base = f"{KEY_PREFIX}{self.name}:{key}"
+        return base + ":lock", base + ":result"
+
+    def _load_shared(self, raw) -> Any:
+        value = self.load(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+        self.stats.remote_shared += 1
+        return value
+
+    def _wait_for_lock(self, client, lock_key: str, result_key: str, token: str):
+        """Take the lock, or return the result of whoever holds it: (locked, raw result)."""
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_SECONDS
+        waited = False
+        while time.monotonic() < deadline:
+            # The holder stores its result before unlocking, so look for it first
+            if waited and (raw := client.get(result_key)) is not None:
+                return False, raw
+            if client.set(lock_key, token, nx=True, px=int(settings.SINGLEFLIGHT_LOCK_SECONDS * 1000)):
+                return True, None
+            waited = True
+            time.sleep(settings.SINGLEFLIGHT_POLL_SECONDS)
+        return False, None
+
+    async def _await_lock(self, client, lock_key: str, result_key: str, token: str):
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_SECONDS
+        waited = False
+        while time.monotonic() < deadline:
+            if waited and (raw := await client.get(result_key)) is not None:
+                return False, raw
+            if await client.set(lock_key, token, nx=True, px=int(settings.SINGLEFLIGHT_LOCK_SECONDS * 1000)):
+                return True, None
+            waited = True
+            await asyncio.sleep(settings.SINGLEFLIGHT_POLL_SECONDS)
+        return False, None
+
+    def _lead_sync(self, key: str, fn: Callable[[], Any]) -> Any:
+        if not self._remote():
+            return fn()
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        try:
+            client = get_redis()
+            locked, raw = self._wait_for_lock(client, lock_key, result_key, token)
+        except Exception as e:
+            self._redis.failed(e)
+            return fn()
+        if raw is not None:
+            try:
+                return self._load_shared(raw)
+            except Exception as e:
+                print(f"⚠️ Single-flight '{self.name}': unreadable shared result, calling again: {e}")
+                return fn()
+        if not locked:
+            return fn()  # waited long enough
+
+        try:
+            result = fn()
+            try:
+                client.set(result_key, self.dump(result), px=int(settings.SINGLEFLIGHT_RESULT_TTL_SECONDS * 1000))
+            except Exception as e:
+                print(f"⚠️ Single-flight '{self.name}': result not shared: {e}")
+            return result
+        finally:
+            try:
+                client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+            except Exception:
+                pass  # the lock expires on its own
+
+    async def _lead_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self._remote():
+            return await fn()
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        try:
+            client = get_async_redis()
+            locked, raw = await self._await_lock(client, lock_key, result_key, token)
+        except Exception as e:
+            self._redis.failed(e)
+            return await fn()
+        if raw is not None:
+            try:
+                return self._load_shared(raw)
+            except Exception as e:
+                print(f"⚠️ Single-flight '{self.name}': unreadable shared result, calling again: {e}")
+                return await fn()
+        if not locked:
+            return await fn()
+
+        try:
+            result = await fn()
+            try:
+                await client.set(result_key, self.dump(result), px=int(settings.SINGLEFLIGHT_RESULT_TTL_SECONDS * 1000))
+            except Exception as e:
+                print(f"⚠️ Single-flight '{self.name}': result not shared: {e}")
+            return result
+        finally:
+            try:
+                await client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+            except Exception:
+                pass
+
+    # --- public API ---
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run `fn` (blocking) unless an identical call is in flight, then share its result."""
+        if not settings.SINGLEFLIGHT_ENABLED:
+            return fn()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    result = self._lead_sync(key, fn)
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, call, error=LeaderCancelled())
+                    raise
+                return self._finish(key, call, result)
+            try:
+                return self.share(call.future.result())
+            except LeaderCancelled:
+                continue
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async variant: `fn` returns a coroutine."""
+        if not settings.SINGLEFLIGHT_ENABLED:
+            return await fn()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    result = await self._lead_async(key, fn)
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    raise
+                except BaseException:
+                    # Cancelled (e.g. the client went away): a follower takes over
+                    self._finish(key, call, error=LeaderCancelled())
+                    raise
+                return self._finish(key, call, result)
+            try:
+                # shield: a cancelled follower must not cancel the shared future
+                return self.share(await asyncio.shield(asyncio.wrap_future(call.future)))
+            except LeaderCancelled:
+                continue
+
+
+def shared_chat_result(result: ChatResult) -> ChatResult:
+    """
+    A copy of someone else's LLM result without its token usage: the tokens were spent
+    (and counted) by the leader's run, so callbacks of the callers sharing it see none.
+    """
+    generations = copy.deepcopy(result.generations)
+    for generation in generations:
+        generation.message.usage_metadata = None
+        generation.message.response_metadata.pop("token_usage", None)
+        if generation.generation_info:
+            generation.generation_info.pop("token_usage", None)
+    return ChatResult(generations=generations)  # llm_output holds the leader's token_usage
+
+
+embedding_flight = SingleFlight("embedding", dump=json.dumps, load=json.loads)
+search_flight = SingleFlight("search", dump=dumps, load=loads)
+llm_flight = SingleFlight(
+    "llm",
+    dump=lambda result: dumps(result.generations),
+    load=lambda raw: shared_chat_result(ChatResult(generations=loads(raw))),
+    share=shared_chat_result,
+)
+flights = {flight.name: flight for flight in (embedding_flight, search_flight, llm_flight)}
+
+
+class SingleFlightEmbeddings(Embeddings):
+    """Deduplicates query embeddings (document batches from ingestion pass straight through)."""
+    def __init__(self, inner: Embeddings, model: str):
+        self.inner = inner
+        self.model = model
+
+    def embed_query(self, text: str) -> list[float]:
+        return embedding_flight.do(flight_key(self.model, text), lambda: self.inner.embed_query(text))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await embedding_flight.ado(flight_key(self.model, text), lambda: self.inner.aembed_query(text))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.inner.aembed_documents(texts)
+
+
+class SingleFlightChatMixin:
+    """
+    Mixed into the chat model classes used for deterministic (temperature 0) calls.
+    Keyed like the LLM cache (model + params + normalized messages) and wrapped around
+    the cache lookup, so concurrent misses for the same prompt make one provider call.
+    """
+    def _flight_key(self, messages, stop, **kwargs) -> str:
+        normalized = [m.model_copy(update={"id": None}) if getattr(m, "id", None) else m for m in messages]
+        return flight_key(self._get_llm_string(stop=stop, **kwargs), dumps(normalized))
+
+    @staticmethod
+    def _own_ids(result: ChatResult, run_manager) -> ChatResult:
+        # A shared result still carries the leader's run id
+        if run_manager:
+            for idx, generation in enumerate(result.generations):
+                generation.message.id = f"{LC_ID_PREFIX}-{run_manager.run_id}-{idx}"
+        return result
+
+    def _generate_with_cache(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        parent = super(SingleFlightChatMixin, self)
+        result = llm_flight.do(
+            self._flight_key(messages, stop, **kwargs),
+            lambda: parent._generate_with_cache(messages, stop=stop, run_manager=run_manager, **kwargs),
+        )
+        return self._own_ids(result, run_manager)
+
+    async def _agenerate_with_cache(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        parent = super(SingleFlightChatMixin, self)
+        result = await llm_flight.ado(
+            self._flight_key(messages, stop, **kwargs),
+            lambda: parent._agenerate_with_cache(messages, stop=stop, run_manager=run_manager, **kwargs),
+        )
+        return self._own_ids(result, run_manager)
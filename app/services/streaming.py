@@ -0,0 +1,189 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from starlette.requests import Request
+
+from app.core.config import settings
+
+# Wire formats for /chat
+FORMAT_LINES = "lines"    # legacy "KIND:data\n" lines (text/plain)
+FORMAT_SSE = "sse"        # Server-Sent Events, multi-line data is safe
+FORMAT_LENGTH = "length"  # "KIND <bytes>\n<payload>\n", binary/newline safe
+
+MEDIA_TYPES = {
+    FORMAT_LINES: "text/plain",
+    FORMAT_SSE: "text/event-stream",
+    FORMAT_LENGTH: "application/x-docnexus-frames",
+}
+
+# Tags on LLM calls whose tokens are never shown to the user. They are filtered out
+# in astream_events itself (exclude_tags), so those events are never produced.
+INTERNAL_TAGS = ["internal_grading", "internal_rewrite", "internal_summary"]
+
+# Request header asking /chat for a final STATS frame (graph loops, node counts,
+# token usage), e.g. for scripts/loadtest.py
+STATS_HEADER = "x-docnexus-stats"
+
+
+def negotiate_format(requested: str | None, accept: str | None) -> str:
+    """Pick the wire format from the ?stream_format= param, then the Accept header."""
+    if requested in MEDIA_TYPES:
+        return requested
+    accept = accept or ""
+    if MEDIA_TYPES[FORMAT_SSE] in accept:
+        return FORMAT_SSE
+    if MEDIA_TYPES[FORMAT_LENGTH] in accept:
+        return FORMAT_LENGTH
+    return settings.STREAM_DEFAULT_FORMAT
+
+
+class StreamEncoder:
+    """
+    Encodes chat events into frames of the chosen format.
+    CONTENT/THINKING deltas are buffered and sent as one frame once STREAM_FLUSH_BYTES
+    have piled up or STREAM_FLUSH_INTERVAL_MS have passed; any other frame flushes first,
+    so ordering is preserved. The interval is only checked when a delta arrives, so
+    whoever sends the frames also calls flush_due() on a timer (cancel_on_disconnect).
+    """
+    def __init__(self, fmt: str = FORMAT_LINES):
+        self.fmt = fmt
+        self.media_type = MEDIA_TYPES[fmt]
+        self.flush_interval = settings.STREAM_FLUSH_INTERVAL_MS / 1000
+        self.flush_bytes = settings.STREAM_FLUSH_BYTES
+        self._kind = None
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def frame(self, kind: str, data: str = "") -> str:
+        if self.fmt == FORMAT_SSE:
+            body = "".join(f"data: {line}\n" for line in data.split("\n"))
+            return f"event: {kind}\n{body}\n"
+        if self.fmt == FORMAT_LENGTH:
+            return f"{kind} {len(data.encode('utf-8'))}\n{data}\n"
+        if kind in ("THINKING_START", "THINKING_END"):
+            return f"{kind}\n"
+        return f"{kind}:{data}\n"
+
+    def flush(self) -> str:
+        """Emit the buffered delta (empty string if nothing is buffered)."""
+        self._last_flush = time.monotonic()
+        if not self._parts:
+            return ""
+        out = self.frame(self._kind, "".join(self._parts))
+        self._kind, self._parts, self._size = None, [], 0
+        return out
+
+    def until_due(self) -> float:
+        """Seconds until buffered deltas are due (one interval if nothing is buffered)."""
+        if not self._parts:
+            return self.flush_interval
+        return max(self._last_flush + self.flush_interval - time.monotonic(), 0.0)
+
+    def flush_due(self) -> str:
+        """Flush the buffer if it has waited a full interval (empty string otherwise)."""
+        if self._parts and self.until_due() <= 0:
+            return self.flush()
+        return ""
+
+    def delta(self, kind: str, text: str) -> str:
+        """Buffer a token delta; returns the frames that are due (often an empty string)."""
+        out = self.flush() if self._kind not in (None, kind) else ""
+        self._kind = kind
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.flush_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+            out += self.flush()
+        return out
+
+    def event(self, kind: str, data: str = "") -> str:
+        """A non-delta frame: flush pending deltas, then the frame itself."""
+        return self.flush() + self.frame(kind, data)
+
+
+@dataclass
+class StreamStats:
+    completed: int = 0
+    cancelled: int = 0
+    cancelled_seconds: float = 0.0  # time runs had spent before their client went away
+
+    def as_dict(self) -> dict:
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "cancelled_seconds": round(self.cancelled_seconds, 3),
+        }
+
+
+stream_stats = StreamStats()
+
+_DONE = object()
+
+
+async def cancel_on_disconnect(
+    request: Request, frames: AsyncIterator[str], label: str = "", encoder: StreamEncoder | None = None
+) -> AsyncIterator[str]:
+    """
+    Drive `frames` in its own task and stop it as soon as the client disconnects.
+    Cancelling the task cancels the graph run (and any in-flight LLM / embedding HTTP
+    calls) instead of letting it finish for nobody.
+    With `encoder`, deltas it has buffered are flushed once they are due even while
+    `frames` is idle (model pause, tool call), so STREAM_FLUSH_INTERVAL_MS is an upper bound.
+    """
+    # Bounded, so a slow client slows the run down instead of the frames piling up in memory
+    queue = asyncio.Queue(maxsize=max(settings.STREAM_QUEUE_SIZE, 1))
+    started = time.perf_counter()
+    stopped = False
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+        finally:
+            # Once stopped nobody reads the queue any more, so don't wait for room in it
+            if not stopped:
+                await queue.put(_DONE)
+
+    def stop():
+        """Cancel the run if it is still going and record it."""
+        nonlocal stopped
+        if stopped or pump_task.done():
+            return
+        stopped = True
+        pump_task.cancel()
+        elapsed = time.perf_counter() - started
+        stream_stats.cancelled += 1
+        stream_stats.cancelled_seconds += elapsed
+        print(f"🛑 Client disconnected, cancelled run {label} after {elapsed:.2f}s")
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(settings.STREAM_DISCONNECT_POLL_SECONDS)
+        stop()
+
+    pump_task = asyncio.create_task(pump())
+    watch_task = asyncio.create_task(watch())
+    timed_flush = encoder is not None and encoder.flush_interval > 0
+    try:
+        while True:
+            if timed_flush and queue.empty():
+                try:
+                    frame = await asyncio.wait_for(queue.get(), encoder.until_due())
+                except asyncio.TimeoutError:
+                    # Only with nothing queued: the buffered text comes after every queued frame
+                    if queue.empty() and (pending := encoder.flush_due()):
+                        yield pending
+                    continue
+            else:
+                frame = await queue.get()
+            if frame is _DONE:
+                break
+            yield frame
+    finally:
+        # Also reached when the server fails to send to a gone client
+        watch_task.cancel()
+        stop()
+        if not stopped:
+            stream_stats.completed += 1
@@ -1,9 +1,39 @@
+from celery.signals import worker_process_init, worker_process_shutdown, task_prerun, task_postrun
+from billiard.process import current_process
+from prometheus_client import start_http_server
+
+from app.core.config import settings
+from app.core.metrics import INGESTION_STAGE_SECONDS
+from app.core.profiling import start_task_profile, stop_task_profile
 from app.core.celery_app import celery_app
 from app.services.dbservice import file_db
+from app.services.text_layer import scan_document
+from app.services.answer_cache import bump_corpus_version
+from app.services.checkpoints import compact_checkpoints
 
 # REMOVED: get_ingestion_service, get_vector_store_service (to prevent heavy loads)
 # REMOVED: docling imports
 
+@worker_process_init.connect
+def serve_metrics(**kwargs):
+    """Each prefork child serves its own /metrics on METRICS_WORKER_PORT + its index"""
+    if settings.METRICS_WORKER_PORT:
+        port = settings.METRICS_WORKER_PORT + getattr(current_process(), "index", 0)
+        start_http_server(port)
+        print(f"📈 Worker metrics on :{port}")
+
+
+if settings.PROFILING_ENABLED:
+    task_prerun.connect(start_task_profile, weak=False)
+    task_postrun.connect(stop_task_profile, weak=False)
+
+
+@worker_process_shutdown.connect
+def close_db_pool(**kwargs):
+    """Release the per-process connection pool when a worker process exits"""
+    file_db.close()
+
+
 @celery_app.task(bind=True)
 def task_ingest_files(self, file_paths_str: list[str], file_ids: list[int], user_id: str):
     """
@@ -13,15 +43,26 @@ def task_ingest_files(self, file_paths_str: list[str], file_ids: list[int], user
     
     # Mark files as failed or completed-with-warning so the UI updates
     try:
-        for fid in file_ids:
+        for fid, path in zip(file_ids, file_paths_str):
+            # The text-layer pre-scan is cheap (no rendering), so it still runs in demo mode
+            try:
+                with INGESTION_STAGE_SECONDS.labels(stage="prescan").time():
+                    job_stats = {"text_layer": scan_document(path)}
+            except Exception as e:
+                print(f"⚠️ Pre-scan failed for {path}: {e}")
+                job_stats = {"text_layer": {"error": str(e)}}
+
             # You can set this to 'failed' or 'completed' depending on what you want the UI to show
             file_db.update_progress(
                 fid, 
                 stage='completed', 
                 status='Demo Mode - Ingestion Disabled', 
-                job_stats={}
+                job_stats=job_stats
             )
             
+        # Ingested content changed -> invalidate this user's cached answers everywhere
+        bump_corpus_version(user_id)
+
         return {
             "status": "skipped",
             "reason": "Demo Mode enabled - Ingestion libraries removed to improve startup time.",
@@ -30,4 +71,14 @@ def task_ingest_files(self, file_paths_str: list[str], file_ids: list[int], user
 
     except Exception as e:
         print(f"❌ Error in mock task: {e}")
-        return {"status": "failed", "error": str(e)}
\ No newline at end of file
+        return {"status": "failed", "error": str(e)}
+
+
+@celery_app.task
+def task_compact_checkpoints():
+    """
+    Periodic (Celery beat): keep only the last CHECKPOINT_KEEP_LAST checkpoints per idle thread.
+    """
+    totals = compact_checkpoints()
+    print(f"🧹 Checkpoint compaction: {totals}")
+    return totals
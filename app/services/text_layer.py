@@ -0,0 +1,107 @@
+import time
+from pathlib import Path
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+from app.core.config import settings
+
+# Page classes produced by the pre-scan
+PAGE_TEXT = "text"        # born-digital, text layer is enough
+PAGE_SCANNED = "scanned"  # image only, needs OCR
+PAGE_MIXED = "mixed"      # text layer + large images (figures, scanned inserts)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tiff", ".bmp"}
+
+
+def _image_coverage(page, page_area: float) -> float:
+    """Fraction of the page covered by image objects (capped at 1.0)."""
+    if page_area <= 0:
+        return 0.0
+
+    covered = 0.0
+    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE], max_depth=2):
+        left, bottom, right, top = obj.get_bounds()
+        covered += max(right - left, 0) * max(top - bottom, 0)
+
+    return min(covered / page_area, 1.0)
+
+
+def classify_page(char_count: int, image_coverage: float) -> str:
+    """
+    Decide whether a page needs OCR.
+    Pages with a real text layer and no big images never go through OCR.
+    """
+    has_text = char_count >= settings.TEXT_LAYER_MIN_CHARS
+    has_images = image_coverage >= settings.TEXT_LAYER_IMAGE_COVERAGE
+
+    if has_text and has_images:
+        return PAGE_MIXED
+    if has_text:
+        return PAGE_TEXT
+    if image_coverage > 0:
+        return PAGE_SCANNED
+    # Blank page (no text, no images) - nothing for OCR to find
+    return PAGE_TEXT
+
+
+def scan_pdf(path: Path) -> list[str]:
+    """Classify every page of a PDF using only the text layer and image bounds (no rendering)."""
+    pdf = pdfium.PdfDocument(str(path))
+    try:
+        page_classes = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                width, height = page.get_size()
+                textpage = page.get_textpage()
+                try:
+                    char_count = textpage.count_chars()
+                finally:
+                    textpage.close()
+                coverage = _image_coverage(page, width * height)
+                page_classes.append(classify_page(char_count, coverage))
+            finally:
+                page.close()
+        return page_classes
+    finally:
+        pdf.close()
+
+
+def scan_document(path: Path) -> dict:
+    """
+    Pre-scan a single document and build its OCR plan.
+    Returns the per-page classes, the pages that need OCR (1-based, Docling convention)
+    and the timing so it can be stored in job_stats.
+    """
+    path = Path(path)
+    ext = path.suffix.lower()
+    start = time.perf_counter()
+
+    if ext == ".pdf":
+        page_classes = scan_pdf(path)
+    elif ext in IMAGE_EXTENSIONS:
+        page_classes = [PAGE_SCANNED]
+    else:
+        # DOCX / HTML / MD etc. are always text based
+        page_classes = []
+
+    if settings.OCR_MODE == "always":
+        ocr_pages = list(range(1, len(page_classes) + 1))
+    elif settings.OCR_MODE == "never":
+        ocr_pages = []
+    else:
+        ocr_pages = [i + 1 for i, cls in enumerate(page_classes) if cls != PAGE_TEXT]
+
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": len(page_classes),
+        "text": page_classes.count(PAGE_TEXT),
+        "scanned": page_classes.count(PAGE_SCANNED),
+        "mixed": page_classes.count(PAGE_MIXED),
+        "page_classes": page_classes,
+        "ocr_pages": ocr_pages,
+        "needs_ocr": bool(ocr_pages),
+        "prescan_seconds": round(elapsed, 4),
+        "pages_per_second": round(len(page_classes) / elapsed, 1) if elapsed > 0 else None,
+    }
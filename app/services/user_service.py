@@ -1,13 +1,50 @@
 from typing import Optional
+import asyncio
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from psycopg_pool import AsyncConnectionPool
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.config import settings
+
+# min/max desired rounds = BCRYPT_ROUNDS, so hashes made with any other cost
+# are flagged by verify_and_update and transparently rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_desired_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_desired_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL, so a small thread pool hashes in parallel
+# without stalling the event loop (and every chat stream on it)
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+# Bounds running + queued hashes; beyond that callers are rejected instead of piling up
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+async def _run_hasher(fn, *args):
+    if _hash_slots.locked():
+        raise PasswordHasherBusy("Too many password operations in progress")
+    async with _hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, fn, *args)
+
+async def hash_password(password: str) -> str:
+    """Hash a password off the event loop"""
+    return await _run_hasher(pwd_context.hash, password)
 
 async def create_user(pool: AsyncConnectionPool, email: str, password: str) -> dict:
     """Create a new user in the database"""
-    password_hash = pwd_context.hash(password)
+    password_hash = await hash_password(password)
     username = email.split('@')[0]  # Simple username from email
     
     async with pool.connection() as conn:
@@ -59,7 +96,27 @@ async def get_user_by_email(pool: AsyncConnectionPool, email: str) -> Optional[d
 
 async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return await _run_hasher(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Verify password against hash.
+    Returns (valid, new_hash); new_hash is set when the stored hash uses outdated cost parameters.
+    """
+    return await _run_hasher(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def update_password_hash(pool: AsyncConnectionPool, user_id: str, password_hash: str):
+    """Store a rehashed password"""
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE users
+                SET password_hash = %s
+                WHERE id = %s
+                """,
+                (password_hash, uuid.UUID(user_id))
+            )
 
 async def get_user_by_id(pool: AsyncConnectionPool, user_id: str) -> Optional[dict]:
     """Retrieve user by ID"""
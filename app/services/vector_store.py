@@ -1,6 +1,6 @@
 from pymilvus import connections, db, utility, Collection
 from langchain_milvus import BM25BuiltInFunction, Milvus
-from langchain_openai import OpenAIEmbeddings
+from app.services.llm import embedding_model
 from langchain_core.documents import Document
 from langchain_classic.retrievers.contextual_compression import ContextualCompressionRetriever
 from langchain_community.document_compressors import FlashrankRerank
@@ -9,14 +9,21 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from app.core.config import settings
 from app.schemas.milvus_schema import get_rag_collection_schema
 from functools import lru_cache
+import json
+import time
+
+from app.core.metrics import INGESTION_STAGE_SECONDS
+
+# RRF constant for fusing the dense and BM25 rankings
+HYBRID_RRF_K = 20
 
 
 class VectorStoreService:
+    # Fused score of a chunk ranked first by both dense and BM25 search
+    max_score = 2 / (HYBRID_RRF_K + 1)
+
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings(
-            api_key=settings.OPEN_ROUTER_API,
-            base_url=settings.OPEN_ROUTER_BASE_URL,
-            model=settings.OPEN_ROUTER_EMBEDDING_MODEL)
+        self.embeddings = embedding_model()
 
         self.uri = settings.MILVUS_URI
         self.db_name = "default"
@@ -116,6 +123,7 @@ class VectorStoreService:
         """
         Add chunks to the collections, if it doesnt exist create new collection
         """
+        started = time.perf_counter()
         final_chunks = []
         print(f"💾 Received {len(chunks)} chunks for optimizing")
         text_splitter = RecursiveCharacterTextSplitter(
@@ -252,6 +260,7 @@ class VectorStoreService:
                 drop_old=True,
             )
         print("✅ Indexing Complete.")
+        INGESTION_STAGE_SECONDS.labels(stage="index").observe(time.perf_counter() - started)
 
     def get_chunks_by_file_id(self, user_id: str, file_id: int, limit: int = 1000):
         """
@@ -326,6 +335,36 @@ class VectorStoreService:
             return []
 
 
+    def search_with_scores(self, user_id: str, query: str, k: int = 20) -> list[tuple[Document, float]]:
+        """
+        Same hybrid (dense + BM25, RRF) search as the retriever, but keeps the fused scores.
+        Documents carry their Milvus pk in metadata.
+        """
+        vectorstore = self._get_milvus_instance()
+        return vectorstore.similarity_search_with_score(
+            query,
+            k=k,
+            expr=f"user_id == '{user_id}'",
+            ranker_type="rrf",
+            ranker_params={"k": HYBRID_RRF_K}
+        )
+
+    def get_chunk_texts(self, user_id: str, chunk_ids: list[str]) -> dict[str, str]:
+        """Fetch chunk texts by pk (scalar query, no vector search)."""
+        if not chunk_ids:
+            return {}
+        connections.connect(uri=self.uri, db_name=self.db_name, token=self.milvus_token)
+        try:
+            db.using_database(self.db_name)
+            collection = Collection(self.collection_name)
+            results = collection.query(
+                expr=f'user_id == "{user_id}" && pk in {json.dumps(list(chunk_ids))}',
+                output_fields=["pk", "text"]
+            )
+            return {str(row["pk"]): row["text"] for row in results}
+        finally:
+            connections.disconnect("default")
+
     def get_retreiver(self, user_id:str):
         vectorstore = self._get_milvus_instance()
         retriever = vectorstore.as_retriever(
@@ -334,7 +373,7 @@ class VectorStoreService:
                 "k": 20,
                 "ranker_type": "rrf",
                 "expr": f"user_id == '{user_id}'",
-                "ranker_params": {"k": 20}
+                "ranker_params": {"k": HYBRID_RRF_K}
             }
         )
 
@@ -343,4 +382,7 @@ class VectorStoreService:
 
 @lru_cache()
 def get_vector_store_service():
+    if settings.VECTOR_STORE_PROVIDER == "fake":
+        from app.services.fakes import FakeVectorStoreService
+        return FakeVectorStoreService()
     return VectorStoreService()
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Login throughput vs. chat stream latency.
+
+Runs a burst of bcrypt verifications while a simulated chat stream ticks every
+10 ms on the same event loop, and reports logins/s plus the stream's p50/p99
+tick lag - once with the old inline call and once through the hashing pool.
+
+Usage:
+    python -m scripts.bench_login [--logins 100] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import time
+
+from app.core.config import settings
+from app.services.user_service import pwd_context, verify_password
+
+PASSWORD = "correct horse battery staple"
+TICK = 0.01
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def chat_stream(stop: asyncio.Event, lags: list[float]):
+    """Stands in for a streaming response: wants to run every TICK seconds."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def run(mode: str, logins: int, concurrency: int, password_hash: str) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with slots:
+            if mode == "inline":
+                # Previous behaviour: bcrypt on the event loop thread
+                pwd_context.verify(PASSWORD, password_hash)
+            else:
+                await verify_password(PASSWORD, password_hash)
+            await asyncio.sleep(0)
+
+    stop, lags = asyncio.Event(), []
+    stream = asyncio.create_task(chat_stream(stop, lags))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await stream
+    return {
+        "mode": mode,
+        "logins_per_second": logins / elapsed,
+        "stream_p50_ms": percentile(lags, 50) * 1000,
+        "stream_p99_ms": percentile(lags, 99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    password_hash = pwd_context.hash(PASSWORD)
+    print(f"🏁 {args.logins} logins | concurrency={args.concurrency} | "
+          f"bcrypt rounds={settings.BCRYPT_ROUNDS} | workers={settings.PASSWORD_HASH_WORKERS}")
+
+    print(f"{'mode':<10} {'logins/s':>10} {'stream p50':>12} {'stream p99':>12}")
+    for mode in ("inline", "executor"):
+        r = await run(mode, args.logins, args.concurrency, password_hash)
+        print(f"{r['mode']:<10} {r['logins_per_second']:>10.1f} {r['stream_p50_ms']:>10.1f}ms {r['stream_p99_ms']:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
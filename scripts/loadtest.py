@@ -0,0 +1,329 @@
+"""
+Replay a JSONL file of questions against /chat and report latency percentiles.
+
+Each line needs a "question" (or "query") field. Every request gets a fresh thread.
+Without --url the app runs in-process (lifespan included), driven directly over ASGI
+so streamed frames are timed as they are produced; with --url it goes over HTTP.
+
+Closed loop by default (--concurrency clients back to back). With --rate, requests
+arrive as a Poisson process at that many per second and latency is measured from the
+scheduled arrival, so time spent waiting for a free slot counts.
+
+Pair with LLM_PROVIDER=fake VECTOR_STORE_PROVIDER=fake to measure only our own overhead.
+
+/chat admits at most CHAT_MAX_STREAMS_PER_USER concurrent streams per user and answers
+the rest with 429. Requests are spread round-robin over the --user-id values (repeat the
+flag), so keep --concurrency within users x that limit, or raise the limit (for example
+CHAT_MAX_STREAMS_PER_USER=8 in the environment of the server, or of this script when
+running in-process). 429s are counted separately from errors.
+
+Usage:
+    python -m scripts.loadtest questions.jsonl --user-id <uuid> [--user-id <uuid> ...] [--concurrency 8] [--rate 0]
+        [--requests N] [--url http://localhost:8000] [--output report.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from app.api.endpoints.auth import create_access_token
+from app.core.config import settings
+from app.services.streaming import STATS_HEADER
+
+CHAT_PATH = "/chat/"
+METRICS = ["ttft_ms", "latency_ms", "loops", "tokens_total", "tokens_output"]
+SETTINGS_SNAPSHOT = [
+    "LLM_PROVIDER", "VECTOR_STORE_PROVIDER", "GRADER_MODE", "REWRITE_MODE",
+    "SPECULATIVE_RETRIEVAL", "ANSWER_CACHE_ENABLED", "LLM_CACHE_NODES", "CONTEXT_TOKEN_BUDGET",
+]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Linear interpolation between closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = pct / 100 * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def load_questions(path: Path) -> list[str]:
+    questions = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            row = json.loads(line)
+            questions.append(row.get("question") or row.get("query"))
+    return [q for q in questions if q]
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+        return commit + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+class FrameParser:
+    """Incremental parser for the length-prefixed wire format ("KIND <bytes>\\n<payload>\\n")."""
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> list[tuple[str, str]]:
+        self._buffer += data
+        frames = []
+        while True:
+            header_end = self._buffer.find(b"\n")
+            if header_end < 0:
+                break
+            kind, _, size = self._buffer[:header_end].decode().partition(" ")
+            end = header_end + 1 + int(size or 0)
+            if len(self._buffer) < end + 1:
+                break
+            frames.append((kind, self._buffer[header_end + 1:end].decode("utf-8")))
+            self._buffer = self._buffer[end + 1:]
+        return frames
+
+
+async def asgi_stream(app, path: str, headers: dict, body: bytes):
+    """
+    POST to an ASGI app and yield (status, body chunk) as the app sends them.
+    httpx's ASGITransport buffers the whole response, which would hide the TTFT.
+    """
+    queue = asyncio.Queue()
+    done = asyncio.Event()
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await queue.put(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"stream_format=length",
+        "root_path": "", "server": ("loadtest", 80), "client": ("127.0.0.1", 0),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    task = asyncio.create_task(app(scope, receive, send))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    status = None
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                task.result()  # re-raise an app crash
+                return
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                yield status, message.get("body", b"")
+                if not message.get("more_body", False):
+                    return
+    finally:
+        done.set()
+        await task
+
+
+async def http_stream(client: httpx.AsyncClient, path: str, headers: dict, body: bytes):
+    async with client.stream("POST", path, params={"stream_format": "length"}, headers=headers, content=body) as response:
+        async for chunk in response.aiter_raw():
+            yield response.status_code, chunk
+
+
+async def run_one(send, question: str, headers: dict, started: float) -> dict:
+    body = json.dumps({"query": question, "thread_id": str(uuid.uuid4())}).encode()
+    parser = FrameParser()
+    result = {"ttft_ms": None, "error": None}
+    try:
+        async for status, chunk in send(CHAT_PATH, headers, body):
+            if status == 429:
+                result["error"] = "HTTP 429"
+                result["rejected"] = True
+                continue
+            if status != 200:
+                result["error"] = f"HTTP {status}"
+                continue
+            for kind, data in parser.feed(chunk):
+                if kind == "CONTENT" and result["ttft_ms"] is None:
+                    result["ttft_ms"] = (time.perf_counter() - started) * 1000
+                elif kind == "ERROR":
+                    result["error"] = data[:200]
+                elif kind == "STATS":
+                    stats = json.loads(data)
+                    result["loops"] = stats.get("loops", 0)
+                    result["tokens_total"] = stats.get("tokens", {}).get("total", 0)
+                    result["tokens_output"] = stats.get("tokens", {}).get("output", 0)
+                    result["cached"] = stats.get("cached", False)
+    except Exception as e:
+        result["error"] = repr(e)[:200]
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def replay(send, questions: list[str], args, headers: list[dict]) -> tuple[list[dict], float]:
+    total = args.requests or len(questions)
+    slots = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def worker(question: str, user_headers: dict, scheduled: float):
+        async with slots:
+            # Closed loop: the clock starts when a slot is free
+            started = scheduled if args.rate else time.perf_counter()
+            results.append(await run_one(send, question, user_headers, started))
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    tasks = []
+    next_arrival = start
+    for i in range(total):
+        if args.rate:
+            next_arrival += rng.expovariate(args.rate)
+            await asyncio.sleep(max(next_arrival - time.perf_counter(), 0))
+        tasks.append(asyncio.create_task(
+            worker(questions[i % len(questions)], headers[i % len(headers)], next_arrival)
+        ))
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    ok = [r for r in results if not r["error"]]
+    rejected = sum(1 for r in results if r.get("rejected"))
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok) - rejected,
+        "rejected": rejected,  # 429 from admission control
+        "cached": sum(1 for r in ok if r.get("cached")),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "metrics": {},
+    }
+    for metric in METRICS:
+        values = [r[metric] for r in ok if r.get(metric) is not None]
+        summary["metrics"][metric] = {
+            "count": len(values),
+            "mean": round(sum(values) / len(values), 3) if values else 0.0,
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+            "max": round(max(values), 3) if values else 0.0,
+        }
+    return summary
+
+
+def print_table(summary: dict, baseline: dict | None = None):
+    print(f"\n{summary['requests']} requests | {summary['errors']} errors | "
+          f"{summary.get('rejected', 0)} rejected (429) | {summary['cached']} cached | "
+          f"{summary['throughput_rps']} req/s over {summary['elapsed_seconds']}s")
+    print(f"{'metric':<14} {'count':>6} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}")
+    for metric, row in summary["metrics"].items():
+        print(f"{metric:<14} {row['count']:>6} {row['mean']:>10.1f} {row['p50']:>10.1f} "
+              f"{row['p95']:>10.1f} {row['p99']:>10.1f} {row['max']:>10.1f}")
+
+    if not baseline:
+        return
+    print(f"\nvs. baseline {baseline['meta']['commit']} (change of p50 / p95 / p99)")
+    for metric, row in summary["metrics"].items():
+        old = baseline["summary"]["metrics"].get(metric)
+        if not old:
+            continue
+        cells = []
+        for pct in ("p50", "p95", "p99"):
+            if not old[pct]:
+                cells.append(f"{'n/a':>10}")
+                continue
+            change = (row[pct] - old[pct]) / old[pct] * 100
+            cells.append(f"{change:>+9.1f}%")
+        print(f"{metric:<14} {' '.join(cells)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", type=Path, help="JSONL with a 'question' per line")
+    parser.add_argument("--user-id", required=True, action="append", dest="user_ids",
+                        help="Existing user the requests run as (repeat to spread them over several users)")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process)")
+    parser.add_argument("--token", help="Bearer token (default: signed locally with JWT_SECRET)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="Arrivals per second (0 = closed loop)")
+    parser.add_argument("--requests", type=int, default=0, help="Total requests (default: one per question)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="Earlier JSON report to diff against")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if not questions:
+        parser.error(f"no questions in {args.questions}")
+    tokens = [args.token] if args.token else [create_access_token({"sub": user_id}) for user_id in args.user_ids]
+    headers = [
+        {"authorization": f"Bearer {token}", "content-type": "application/json", STATS_HEADER: "1"}
+        for token in tokens
+    ]
+
+    mode = f"http {args.url}" if args.url else "in-process"
+    print(f"🏁 {args.requests or len(questions)} requests | {mode} | concurrency={args.concurrency} | "
+          f"rate={args.rate or 'closed loop'} | llm={settings.LLM_PROVIDER} | vector store={settings.VECTOR_STORE_PROVIDER}")
+    # Only this process's settings are known; a --url server may be configured differently
+    admitted = len(headers) * settings.CHAT_MAX_STREAMS_PER_USER
+    if args.concurrency > admitted:
+        print(f"⚠️ --concurrency {args.concurrency} is above {len(headers)} user(s) x CHAT_MAX_STREAMS_PER_USER="
+              f"{settings.CHAT_MAX_STREAMS_PER_USER}: expect 429s. Add --user-id values or raise the limit.")
+
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, timeout=None, limits=limits) as client:
+            results, elapsed = await replay(
+                lambda path, h, body: http_stream(client, path, h, body), questions, args, headers
+            )
+    else:
+        from app.main import app
+        async with app.router.lifespan_context(app):
+            results, elapsed = await replay(
+                lambda path, h, body: asgi_stream(app, path, h, body), questions, args, headers
+            )
+
+    for result in results:
+        if result["error"] and not result.get("rejected"):
+            print(f"❌ {result['error']}")
+            break
+
+    summary = summarize(results, elapsed)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_table(summary, baseline)
+
+    if args.output:
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "mode": mode,
+                "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items() if k != "token"},
+                "settings": {name: getattr(settings, name) for name in SETTINGS_SNAPSHOT},
+            },
+            "summary": summary,
+            "requests": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\n📝 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
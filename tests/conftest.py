@@ -0,0 +1,22 @@
+"""Run the tests against the in-process fakes: no LLM provider, Milvus or Redis needed."""
+import os
+
+os.environ.update(
+    LLM_PROVIDER="fake",
+    VECTOR_STORE_PROVIDER="fake",
+    FAKE_LLM_TTFT_MS="0",
+    FAKE_LLM_TOKEN_MS="0",
+    FAKE_VECTOR_STORE_LATENCY_MS="0",
+    LLM_CACHE_REDIS="false",
+    SINGLEFLIGHT_REDIS="false",
+    RELEVANCE_LOG_PATH="",
+)
+for name, value in {
+    "PORT": "8000",
+    "OPEN_ROUTER_API": "test",
+    "MILVUS_URI": "http://localhost:19530",
+    "MILVUS_TOKEN": "test",
+    "DB_URI": "postgresql://localhost/test",
+    "JWT_SECRET": "test",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,58 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from app.core.config import settings
+from app.services.graph import nodes
+from app.services.graph.graph import build_rag_graph
+from app.services.graph.tools import UserContext, get_retrievel_tool
+
+
+class ScriptedRouter:
+    """Replays the router's decisions in order."""
+    def __init__(self, responses: list[AIMessage]):
+        self.responses = list(responses)
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        return self.responses.pop(0)
+
+
+def search(query: str) -> AIMessage:
+    call = {"name": get_retrievel_tool.name, "args": {"query": query}, "id": f"call_{len(query)}", "type": "tool_call"}
+    return AIMessage(content="", tool_calls=[call])
+
+
+def test_chunks_rejected_in_one_turn_are_graded_again_in_the_next(monkeypatch):
+    monkeypatch.setattr(settings, "REWRITE_MODE", "sequential")
+    monkeypatch.setattr(settings, "SPECULATIVE_RETRIEVAL", False)
+    monkeypatch.setattr(settings, "RELEVANCE_GATE", "off")
+    # Turn 1: search, reject everything, rewrite, then the router answers without the tool.
+    # Turn 2: search for the same thing again.
+    monkeypatch.setattr(nodes, "router_model", ScriptedRouter([
+        search("revenue growth"),
+        AIMessage(content="I could not find that in your documents."),
+        search("revenue growth"),
+    ]))
+    graded: list[list[str]] = []
+
+    async def grade(question, chunks, scores):
+        graded.append(list(chunks))
+        return [] if len(graded) == 1 else list(chunks)
+
+    monkeypatch.setattr(nodes, "_gate_and_grade", grade)
+
+    graph = build_rag_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "two-turns"}}
+    context = UserContext(user_id="u1")
+
+    async def run():
+        await graph.ainvoke({"messages": [HumanMessage(content="What was revenue growth?")]}, config=config, context=context)
+        await graph.ainvoke({"messages": [HumanMessage(content="And revenue growth last year?")]}, config=config, context=context)
+        return await graph.aget_state(config)
+
+    state = asyncio.run(run())
+
+    assert len(graded) == 2
+    assert graded[0] and set(graded[0]) <= set(graded[1])
+    assert state.values["documents"] == [] and state.values["graded_ids"] == []
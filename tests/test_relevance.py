@@ -0,0 +1,21 @@
+from app.services.graph.relevance import entity_overlap, question_entities
+
+
+def test_sentence_initial_words_are_not_entities():
+    assert question_entities("Explain the Acme merger in 2021.") == {"acme", "2021"}
+    assert question_entities("Summarize the report. Compare Globex with Initech.") == {"globex", "initech"}
+
+
+def test_question_words_numbers_and_acronyms():
+    assert question_entities("What was the EBITDA margin of Acme in Q3 2023?") == {"ebitda", "acme", "q3", "2023"}
+    assert question_entities("How much did revenue grow from 1,200 to 3.5?") == {"1,200", "3.5"}
+
+
+def test_content_words_when_there_are_no_entities():
+    assert question_entities("Explain how the refund policy works") == {"explain", "refund", "policy", "works"}
+
+
+def test_entity_overlap():
+    entities = question_entities("Compare Globex and Initech revenue in 2022")
+    assert entity_overlap(entities, "Globex reported record revenue in 2022.") == 2 / 3
+    assert entity_overlap(set(), "anything") == 0.0
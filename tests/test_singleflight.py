@@ -0,0 +1,28 @@
+import asyncio
+
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.messages import HumanMessage
+
+from app.core.config import settings
+from app.services.fakes import SingleFlightFakeChatModel
+from app.services.singleflight import llm_flight
+
+
+def test_shared_llm_results_carry_no_token_usage(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_LLM_TTFT_MS", 50)
+    model = SingleFlightFakeChatModel(model="fake", temperature=0)
+    messages = [HumanMessage(content="Summarize the Acme contract")]
+    handlers = [UsageMetadataCallbackHandler() for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*(model.ainvoke(messages, config={"callbacks": [h]}) for h in handlers))
+
+    shared_before = llm_flight.stats.shared
+    results = asyncio.run(run())
+
+    assert llm_flight.stats.shared - shared_before == 2
+    assert len({result.content for result in results}) == 1
+    # Only the caller that made the call reports (and is billed for) its tokens
+    assert sum(result.usage_metadata is not None for result in results) == 1
+    assert sum(bool(handler.usage_metadata) for handler in handlers) == 1
+    assert len({result.id for result in results}) == 3